@@ -1,72 +1,551 @@
-
-from asyncio import threads
-import matchering as mg
+import io
+import os
+import uuid
+import hashlib
 import logging
+import threading
+from time import time
+from collections import OrderedDict
+from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor, Future
+import matchering as mg
+from matchering.log import Code
+from pedalboard.io import ReadableAudioFile
 # web service variation
-from flask import Flask, request
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 
 from matchering.loader import delete_temp, get_temp_name, load_binary, save_temp
+from matchering.tracing import resident_memory
 from matchering.utils import debugger_is_active
 
+# The number of tracks processed at the same time
+WORKERS = int(os.environ.get("MATCHERING_WORKERS", os.cpu_count() or 1))
+# The number of HTTP threads, uploads and status requests don't wait for the workers
+THREADS = int(os.environ.get("MATCHERING_THREADS", 16))
+# Finished jobs whose result was never downloaded are deleted after this many seconds
+JOB_TTL = int(os.environ.get("MATCHERING_JOB_TTL", 60 * 60))
+# Uploads and results up to this size in bytes never touch the disk
+SPILL_SIZE = int(os.environ.get("MATCHERING_SPILL_SIZE", 64 * 2 ** 20))
+# The masters of the recent uploads are kept for resubmissions: up to this many
+# bytes in total, each one for this many seconds. 0 disables the cache
+CACHE_SIZE = int(os.environ.get("MATCHERING_CACHE_SIZE", 256 * 2 ** 20))
+CACHE_TTL = int(os.environ.get("MATCHERING_CACHE_TTL", 60 * 60))
+
+TEMP_FOLDER = "download"
+RESULT_FOLDER = "result"
+
+# Create a custom Config instance to edit matchering configuration
+# Think twice before you change something here
+CONFIG = mg.Config(
+    fft_size= 8192,
+    # Change the temp folder to work with ffmpeg
+    # temp_folder="/tmp",
+    reference_processed = True,
+    reference_preset = True,
+    # Every worker process runs one job at a time
+    limiter_pool_size = 1,
+    # high_filter = 800, in Hz
+    # low_filter = 200, in Hz
+    # Etc...
+    # The remaining parameters will be filled with default values
+    # Examine defaults.py to find other parameters
+)
+
 # any name will work for internal identification
 app = Flask(__name__)
 CORS(app)
 
-@app.route('/matchering',methods=['GET','POST'])
 
-    # methods go here
-def matchering():
+class Job:
+    def __init__(self, job_id: str, key: str):
+        self.id = job_id
+        # Identical uploads with the same parameters share the key and the future
+        self.key = key
+        self.created = time()
+        # The result of the future is the master as bytes, or the name of its
+        # file in RESULT_FOLDER if it was bigger than SPILL_SIZE
+        self.future = None
+
+
+class ResultCache:
+    """The masters of the recent uploads, least recently used are evicted first"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()  # key -> (master, expiration time)
+
+    def get(self, key: str) -> bytes:
+        entry = self.__entries.get(key)
+        if entry and entry[1] < time():
+            self.__pop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, master: bytes) -> None:
+        if len(master) > self.max_size:
+            return
+        self.__pop(key)
+        self.__entries[key] = master, time() + self.ttl
+        self.size += len(master)
+        while self.size > self.max_size:
+            self.__pop(next(iter(self.__entries)))
+
+    def __pop(self, key: str) -> None:
+        entry = self.__entries.pop(key, None)
+        if entry:
+            self.size -= len(entry[0])
+
+
+class Counter:
+    """A Prometheus counter, labelled by keyword arguments"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with metrics_lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    @staticmethod
+    def labels(key: tuple, **extra) -> str:
+        pairs = [f'{name}="{value}"' for name, value in key + tuple(extra.items())]
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> list:
+        return [(self.name + self.labels(key), value) for key, value in self.values.items()]
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with metrics_lock:
+            lines += [f"{name} {float(value)!r}" for name, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Histogram(Counter):
+    """A Prometheus histogram, labelled by keyword arguments"""
 
+    kind = "histogram"
+    buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with metrics_lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            # The buckets are cumulative, the last one is +Inf
+            counts = [
+                count + (value <= bucket)
+                for count, bucket in zip(counts, self.buckets + (float("inf"),))
+            ]
+            self.values[key] = counts, total + value
+
+    def samples(self) -> list:
+        samples = []
+        for key, (counts, total) in self.values.items():
+            samples += [
+                (self.name + "_bucket" + self.labels(key, le=bucket), count)
+                for bucket, count in zip(self.buckets + ("+Inf",), counts)
+            ]
+            samples += [
+                (self.name + "_sum" + self.labels(key), total),
+                (self.name + "_count" + self.labels(key), counts[-1]),
+            ]
+        return samples
+
+
+metrics_lock = threading.Lock()
+http_requests = Counter(
+    "matchering_http_requests_total", "HTTP requests by endpoint and status code"
+)
+http_request_seconds = Histogram(
+    "matchering_http_request_seconds", "HTTP request latency by endpoint"
+)
+http_received_bytes = Counter(
+    "matchering_http_received_bytes_total", "Bytes received in HTTP request bodies"
+)
+http_sent_bytes = Counter(
+    "matchering_http_sent_bytes_total", "Bytes sent in HTTP response bodies"
+)
+job_outcomes = Counter(
+    "matchering_jobs_total",
+    "Jobs by outcome: queued, shared (with a job in flight), cached, completed, failed",
+)
+stage_seconds = Histogram(
+    "matchering_stage_seconds", "Wall time of the mg.process stages"
+)
+audio_seconds = Counter(
+    "matchering_audio_seconds_total", "Duration of the mastered tracks"
+)
+processing_seconds = Counter(
+    "matchering_processing_seconds_total", "Wall time of the workers spent on the tracks"
+)
+METRICS = [
+    http_requests,
+    http_request_seconds,
+    http_received_bytes,
+    http_sent_bytes,
+    job_outcomes,
+    stage_seconds,
+    audio_seconds,
+    processing_seconds,
+]
+# The stages of mg.process, each one lasts until the next code
+STAGES = {
+    Code.INFO_LOADING: "load",
+    Code.INFO_MATCHING_LEVELS: "match_levels",
+    Code.INFO_MATCHING_FREQS: "match_frequencies",
+    Code.INFO_CORRECTING_LEVELS: "correct_levels",
+    Code.INFO_FINALIZING: "finalize",
+    Code.INFO_EXPORTING: "export",
+    Code.INFO_MAKING_PREVIEWS: "previews",
+}
+worker_memory = {}  # worker pid -> resident memory in bytes after its last job
+
+
+jobs = {}
+# The computations in flight: key -> future, shared by the identical jobs
+running = {}
+jobs_lock = threading.Lock()
+cache = ResultCache(CACHE_SIZE, CACHE_TTL)
+# Shared with the worker processes: job key -> the last stage Code of the job
+progress = None
+# Shared with the worker processes: the metrics events of run_job()
+events = None
+executor = None
+
+
+def set_log_handlers(code_handler=None):
+    if debugger_is_active():
+        mg.log(print, code_handler=code_handler)
+    else:
+        mg.log(
+            logging.debug,
+            info_handler=logging.info,
+            warning_handler=logging.warning,
+            code_handler=code_handler,
+        )
+
+
+def warmup_worker():
+    # Every worker loads the limiter, the preset and the FFT plans before its first job
+    set_log_handlers()
     try:
-        
-        data = request.files['song']  # parse arguments to dictionary
-        noEQ = request.form['noEQ']
-        
-        temp_folder = "download"
-        result_folder = "result"
-        temp_file, file_ext, file_path = get_temp_name(data.filename, temp_folder)
-        data.save(file_path)
+        mg.warmup(CONFIG)
+    except Exception as e:
+        # The jobs report the same error, the worker must not break the pool
+        logging.error(e)
 
-        logging.info("starting process")
-        
-            
+
+def run_job(key: str, upload, file_ext: str, no_eq: bool, progress, events):
+    # Runs in a worker process, the stages of mg.process are reported by their codes.
+    # upload: the uploaded bytes, or the name of the spilled upload in TEMP_FOLDER.
+    # events: the metrics for the server, ("stage", name, seconds), ("audio", seconds),
+    # ("processing", seconds) and ("memory", pid, bytes)
+    timer = time()
+    stage = [None, timer]
+
+    def end_stage():
+        if stage[0] in STAGES:
+            events.put(("stage", STAGES[stage[0]], time() - stage[1]))
+
+    def report_stage(code: Code, *args, **kwargs):
+        if Code.INFO_WAITING <= code <= Code.INFO_COMPLETED:
+            progress[key] = int(code)
+            end_stage()
+            stage[:] = code, time()
+
+    set_log_handlers(report_stage)
+    spilled = isinstance(upload, str)
+    target = os.path.join(TEMP_FOLDER, upload) if spilled else io.BytesIO(upload)
+    result = io.BytesIO()
+    try:
         mg.process(
             # The track you want to master
-            target=temp_folder + "\\" + temp_file,
+            target=target,
             # Some "wet" reference track
             reference="",
             # Where and how to save your results
             results=[
                 #mg.pcm16("my_song_master_16bit.wav"),
                 mg.Result(
-                    result_folder + "\\" + temp_file,"LAME" if file_ext == "MP3" else "PCM_24", 
-                    use_limiter=True, normalize=True, no_eq= True if noEQ == 'true' else False
+                    result, "LAME" if file_ext == "MP3" else "PCM_24",
+                    use_limiter=True, normalize=True, no_eq=no_eq, format=file_ext.lower()
                 ),
             ],
-            # Create a custom Config instance to edit matchering configuration
-            # Think twice before you change something here
-            config=mg.Config(
-                fft_size= 8192,
-                # Change the temp folder to work with ffmpeg
-                # temp_folder="/tmp",
-                reference_processed = True,
-                reference_preset = True,
-                # high_filter = 800, in Hz
-                # low_filter = 200, in Hz
-                # Etc...
-                # The remaining parameters will be filled with default values
-                # Examine defaults.py to find other parameters
-            ),
+            # The matchering configuration shared by all the jobs, see CONFIG
+            config=CONFIG,
+        )
+        if not spilled:
+            target.seek(0)
+        with ReadableAudioFile(target) as f:
+            events.put(("audio", f.duration))
+    finally:
+        end_stage()
+        events.put(("processing", time() - timer))
+        events.put(("memory", os.getpid(), resident_memory()))
+        if spilled:
+            delete_temp(upload, TEMP_FOLDER)
+
+    if result.getbuffer().nbytes > SPILL_SIZE:
+        return save_temp(result.getbuffer(), RESULT_FOLDER)
+    return result.getvalue()
+
+
+def upload_key(stream, file_ext: str, no_eq: bool) -> str:
+    # The content of the upload and everything that changes its master
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(2 ** 20), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return f"{digest.hexdigest()}-{file_ext}-{no_eq}"
+
+
+def cache_result(key: str, future: Future) -> None:
+    job_outcomes.inc(outcome="failed" if future.exception() else "completed")
+    with jobs_lock:
+        running.pop(key, None)
+        if not future.exception() and isinstance(future.result(), bytes):
+            cache.put(key, future.result())
+
+
+def submit_job() -> Job:
+    data = request.files['song']  # parse arguments to dictionary
+    noEQ = request.form['noEQ']
+
+    temp_file, file_ext, file_path = get_temp_name(data.filename, TEMP_FOLDER)
+    job = Job(uuid.uuid4().hex, upload_key(data.stream, file_ext, noEQ == 'true'))
+
+    with jobs_lock:
+        master = cache.get(job.key)
+        if master is not None:
+            logging.info(f"job {job.id} is a resubmission, the cached master is used")
+            job_outcomes.inc(outcome="cached")
+            job.future = Future()
+            job.future.set_result(master)
+        elif job.key in running:
+            logging.info(f"job {job.id} is a duplicate of a job in progress")
+            job_outcomes.inc(outcome="shared")
+            job.future = running[job.key]
+        if job.future:
+            jobs[job.id] = job
+            return job
+
+    data.stream.seek(0, os.SEEK_END)
+    spilled = data.stream.tell() > SPILL_SIZE
+    data.stream.seek(0)
+    if spilled:
+        data.save(file_path)
+        upload = temp_file
+    else:
+        upload = data.read()
+
+    with jobs_lock:
+        # An identical job could be submitted while this upload was being read
+        job.future = running.get(job.key)
+        if job.future is None:
+            progress[job.key] = int(Code.INFO_WAITING)
+            try:
+                job.future = executor.submit(
+                    run_job, job.key, upload, file_ext, noEQ == 'true', progress, events
+                )
+            except Exception:
+                progress.pop(job.key, None)
+                if spilled:
+                    delete_temp(temp_file, TEMP_FOLDER)
+                raise
+            running[job.key] = job.future
+            job_outcomes.inc(outcome="queued")
+            job.future.add_done_callback(lambda future: cache_result(job.key, future))
+            spilled = False
+        else:
+            job_outcomes.inc(outcome="shared")
+        jobs[job.id] = job
+    if spilled:
+        delete_temp(temp_file, TEMP_FOLDER)
+    logging.info(f"job {job.id} is queued")
+    return job
+
+
+def forget_job(job: Job) -> None:
+    with jobs_lock:
+        jobs.pop(job.id, None)
+        # The progress and the spilled master are shared by the identical jobs
+        if any(other.future is job.future for other in jobs.values()):
+            return
+        if job.key not in running:
+            progress.pop(job.key, None)
+    if job.future.done() and not job.future.exception():
+        if isinstance(job.future.result(), str):
+            delete_temp(job.future.result(), RESULT_FOLDER)
+
+
+def job_result(job: Job) -> bytes:
+    result = job.future.result()
+    if isinstance(result, str):
+        result = load_binary(result, RESULT_FOLDER)
+    forget_job(job)
+    return result
+
+
+def forget_expired_jobs() -> None:
+    with jobs_lock:
+        expired = [
+            job for job in jobs.values()
+            if job.future.done() and time() - job.created > JOB_TTL
+        ]
+    for job in expired:
+        forget_job(job)
+
+
+def job_status(job: Job) -> dict:
+    code = Code.INFO_COMPLETED
+    if not job.future.done() or job.future.exception():
+        code = Code(progress.get(job.key, Code.INFO_WAITING))
+    status = {
+        "id": job.id,
+        "code": int(code),
+        "stage": code.name,
+        "progress": (code - Code.INFO_WAITING) / (Code.INFO_COMPLETED - Code.INFO_WAITING),
+    }
+    if not job.future.done():
+        status["status"] = "queued" if code == Code.INFO_WAITING else "running"
+    elif job.future.exception():
+        status["status"] = "failed"
+        status["error"] = str(job.future.exception())
+    else:
+        status["status"] = "done"
+    return status
+
+
+def get_job(job_id: str) -> Job:
+    with jobs_lock:
+        return jobs.get(job_id)
+
+
+def collect_events() -> None:
+    # Runs in a daemon thread for the life of the server,
+    # the queue doesn't grow between the scrapes of /metrics
+    while True:
+        event = events.get()
+        if event[0] == "stage":
+            stage_seconds.observe(event[2], stage=event[1])
+        elif event[0] == "audio":
+            audio_seconds.inc(event[1])
+        elif event[0] == "processing":
+            processing_seconds.inc(event[1])
+        elif event[0] == "memory" and event[2] is not None:
+            worker_memory[event[1]] = event[2]
+
+
+@app.before_request
+def start_timer():
+    g.started = time()
+
+
+@app.after_request
+def count_request(response):
+    endpoint = request.endpoint or "unknown"
+    http_requests.inc(endpoint=endpoint, status=response.status_code)
+    http_request_seconds.observe(time() - g.started, endpoint=endpoint)
+    http_received_bytes.inc(request.content_length or 0, endpoint=endpoint)
+    http_sent_bytes.inc(response.calculate_content_length() or 0, endpoint=endpoint)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # The Prometheus text format, the gauges are measured on every scrape
+    with jobs_lock:
+        queued = sum(
+            1 for key in running if progress.get(key, Code.INFO_WAITING) == Code.INFO_WAITING
         )
+        in_progress = len(running) - queued
+    gauges = [
+        ("matchering_jobs_queued", "Computations waiting for a worker", queued),
+        ("matchering_jobs_running", "Computations being processed", in_progress),
+        ("matchering_workers", "Worker processes", WORKERS),
+        ("matchering_cache_bytes", "Size of the cached masters", cache.size),
+        ("matchering_cache_hits_total", "Cache hits", cache.hits),
+        ("matchering_cache_misses_total", "Cache misses", cache.misses),
+        ("process_resident_memory_bytes", "Resident memory of the server", resident_memory()),
+        (
+            "matchering_workers_resident_memory_bytes",
+            "Resident memory of the worker processes after their last job",
+            sum(worker_memory.values()) if worker_memory else None,
+        ),
+    ]
+    lines = [metric.expose() for metric in METRICS]
+    for name, description, value in gauges:
+        if value is not None:
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# HELP {name} {description}\n# TYPE {name} {kind}\n{name} {float(value)!r}")
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    forget_expired_jobs()
+    job = submit_job()
+    return jsonify(job_status(job)), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return "unknown job", 404
+    return jsonify(job_status(job)), 200
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return "unknown job", 404
+    status = job_status(job)
+    if status["status"] in ("queued", "running"):
+        return jsonify(status), 202
+    if status["status"] == "failed":
+        forget_job(job)
+        return status["error"], 500
+    return job_result(job), 200
+
+
+@app.route('/matchering',methods=['GET','POST'])
+
+    # methods go here
+def matchering():
+    # The original synchronous API, the track waits in the same queue as the jobs
+
+    job = None
+    try:
+        forget_expired_jobs()
+        job = submit_job()
+
+        logging.info("starting process")
+        job.future.result()
         logging.info("process done")
-        result = load_binary(temp_file, result_folder)
-        delete_temp(temp_file,temp_folder)
-        delete_temp(temp_file,result_folder)
+        result = job_result(job)
 
         return result, 200  # return data with 200 OK
-    except RuntimeError as e:
+    except Exception as e:
         logging.error(e)
+        if job and job.future.done():
+            forget_job(job)
         e = str(e)
         return e, 500
 
@@ -74,16 +553,20 @@ def matchering():
 if __name__ == '__main__':
     # Sending all log messages to the default print function
     # Just delete the following line to work silently
-    if mg.utils.debugger_is_active():
-        mg.log(print)
-    else:
+    if not debugger_is_active():
         logging.basicConfig(filename="log.txt", level=logging.INFO)
-        mg.log(logging.debug)
-        mg.log(info_handler=logging.info)
-        mg.log(warning_handler=logging.warning)
-              
+    set_log_handlers()
+
+    manager = Manager()
+    progress = manager.dict()
+    events = manager.Queue()
+    threading.Thread(target=collect_events, name="collect_events", daemon=True).start()
+    executor = ProcessPoolExecutor(max_workers=WORKERS, initializer=warmup_worker)
+    # The workers start and warm up now rather than on the first uploads
+    for _ in range(WORKERS):
+        executor.submit(int)
+
     # run our Flask app
     from waitress import serve
-    serve(app, host="127.0.0.1", port=5001, threads=1)
-    # app.run(debug=False)  
-
+    serve(app, host="127.0.0.1", port=5001, threads=THREADS)
+    # app.run(debug=False)
@@ -0,0 +1,44 @@
+import matchering as mg
+from matchering.benchmark import run_benchmark, compare, STAGES
+import argparse
+import json
+import sys
+import tempfile
+
+parser = argparse.ArgumentParser(description='Benchmark the matchering stages on synthetic audio')
+parser.add_argument("--durations", type=float, nargs="+", default=[30, 3 * 60, 15 * 60, 60 * 60], help="(Optional) target lengths in seconds, 30 s, 3, 15 and 60 min by default")
+parser.add_argument("--output", type=str, default="benchmark.json", help="(Optional) JSON file to save the results to")
+parser.add_argument("--compare", type=str, default=None, help="(Optional) JSON file of an earlier run to compare with")
+parser.add_argument("--repeat", type=int, default=1, help="(Optional) runs per duration, the fastest one is kept")
+parser.add_argument("--no_limiter", action="store_true", help="(Optional) render without the limiter")
+parser.add_argument("--folder", type=str, default=None, help="(Optional) folder for the synthetic tracks, a temporary one by default")
+args = parser.parse_args()
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory(dir=args.folder) as folder:
+        report = run_benchmark(
+            args.durations,
+            folder,
+            use_limiter=not args.no_limiter,
+            repeat=args.repeat,
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"import matchering: {report['import']['seconds']:.2f} s")
+    for module in report["import"]["deferred_modules_loaded"]:
+        print(f"    {module} is loaded on import, it must be deferred")
+
+    for run in report["runs"]:
+        print(f"{run['seconds']:g} s of audio: {run['wall_time']:.2f} s, {run['throughput']:.1f}x real time")
+        for stage in STAGES:
+            if stage in run["stages"]:
+                data = run["stages"][stage]
+                print(f"    {stage:<16} {data['wall_time']:8.3f} s  {data['throughput']:8.1f}x  {data['calls']} calls")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(json.load(f), report)))
+
+    sys.exit(1 if report["import"]["deferred_modules_loaded"] else 0)
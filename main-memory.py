@@ -0,0 +1,38 @@
+import matchering as mg
+from matchering.memory import measure_memory, check_budgets, DEFAULT_BUDGETS
+import argparse
+import json
+import sys
+import tempfile
+
+parser = argparse.ArgumentParser(description='Measure the peak memory of the matchering stages on synthetic audio')
+parser.add_argument("--seconds", type=float, default=3 * 60, help="(Optional) target length in seconds, 3 min by default")
+parser.add_argument("--budget", type=str, nargs="*", default=[], help='(Optional) stage budgets in float64 copies of the target, e.g. "process=4.5"')
+parser.add_argument("--output", type=str, default=None, help="(Optional) JSON file to save the results to")
+parser.add_argument("--no_limiter", action="store_true", help="(Optional) render without the limiter")
+parser.add_argument("--folder", type=str, default=None, help="(Optional) folder for the synthetic tracks, a temporary one by default")
+args = parser.parse_args()
+
+if __name__ == "__main__":
+    budgets = dict(DEFAULT_BUDGETS)
+    for budget in args.budget:
+        name, value = budget.split("=")
+        budgets[name] = float(value)
+
+    with tempfile.TemporaryDirectory(dir=args.folder) as folder:
+        report = measure_memory(args.seconds, folder, use_limiter=not args.no_limiter)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(f"{args.seconds:g} s of audio, one float64 copy is {report['input_size'] / 2 ** 20:.1f} MiB")
+    print(f"    {'stage':<24} {'peak':>6} {'retained':>9} {'RSS peak':>9} {'budget':>7}")
+    for name, stage in report["stages"].items():
+        budget = f"{budgets[name]:7.2f}" if name in budgets else ""
+        print(f"    {name:<24} {stage['peak']:6.2f} {stage['retained']:9.2f} {stage['rss_peak']:9.2f} {budget}")
+
+    violations = check_budgets(report, budgets)
+    for violation in violations:
+        print(f"Over budget: {violation}")
+    sys.exit(1 if violations else 0)
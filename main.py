@@ -28,6 +28,8 @@ mg.process(
         # Change the threshold value (float, not dB) from the default value of 0.9981 (-0.01 dB)
         # threshold=0.7079,  # -3 dB
         fft_size= 8192,
+        # Use all the cores for the FFTs of this single track
+        # fft_workers=-1,
         # Change the temp folder to work with ffmpeg
         # temp_folder="/tmp",
         # Lower the preview length to 15 seconds from the default value of 30
@@ -50,4 +52,8 @@ mg.process(
             "examples\\preview.mp3","LAME", use_limiter=True, normalize=True,
             no_eq= False
         ),
+    # Save the previews before rendering the whole track
+    # preview_first=True,
+    # Collect the timing of every stage, see mg.TraceCollector
+    # tracer=tracer,
 )
@@ -25,6 +25,10 @@ __version__ = "2.0.5"
 from .log.handlers import set_handlers as log
 from .results import Result, pcm16, pcm24
 from .defaults import Config
-from .core import process
+from .core import process, warmup
+from .stream import process_stream
+from .batch import process_many
 from .loader import load
 from .checker import check
+from .fingerprint import AudioFingerprint, fingerprint_audio
+from .tracing import Tracer, TraceCollector
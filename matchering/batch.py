@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import pickle
+import numpy as np
+from time import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pedalboard.io import ReadableAudioFile
+
+from .log import Code, info, debug, debug_line
+from .log.handlers import get_handlers, set_handlers
+from . import Config
+from .core import process, get_reference_analysis
+from .stage_helpers import ReferenceAnalysis
+from .presets import get_preset
+
+# The peak of process() in copies of the stereo target: 4.6 on a 3 min track and 4.0
+# on a 15 min one (main-memory.py, see memory.DEFAULT_BUDGETS), rounded up for the decoder
+# buffers and the allocator
+FULL_LENGTH_COPIES = 6
+
+
+class JobReport:
+    def __init__(
+        self,
+        target: str,
+        completed: bool = False,
+        error: str = None,
+        seconds: float = 0.0,
+        estimated_memory: int = 0,
+    ):
+        self.target = target
+        self.completed = completed
+        self.error = error
+        self.seconds = seconds
+        self.estimated_memory = estimated_memory
+
+    def __repr__(self):
+        status = "completed" if self.completed else f"failed: {self.error}"
+        return f"JobReport('{self.target}', {status}, {self.seconds:.2f} s)"
+
+
+def estimate_memory(file: str, config: Config) -> int:
+    with ReadableAudioFile(file) as f:
+        frames = f.duration * config.internal_sample_rate
+    return int(frames * 2 * np.dtype(config.precision).itemsize * FULL_LENGTH_COPIES)
+
+
+def available_memory() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def __picklable_handlers() -> dict:
+    # The workers get the log handlers of the caller, the ones that cannot be pickled
+    # (lambdas, bound methods of local objects) are left out
+    handlers = {}
+    for key, handler in get_handlers().items():
+        try:
+            pickle.dumps(handler)
+        except Exception:
+            debug(f"The {key} cannot be passed to the workers, it is not picklable")
+            continue
+        handlers[key] = handler
+    return handlers
+
+
+def __init_worker(handlers: dict) -> None:
+    # Forked workers already have all the handlers of the caller
+    set_handlers(**{**get_handlers(), **handlers})
+
+
+def __run_job(
+    target: str,
+    reference: str,
+    results: list,
+    config: Config,
+    reference_analysis: ReferenceAnalysis,
+) -> (bool, str, float):
+    timer = time()
+    try:
+        process(
+            target,
+            reference,
+            results,
+            config,
+            reference_analysis=reference_analysis,
+        )
+    except Exception as e:
+        return False, str(e), time() - timer
+    return True, None, time() - timer
+
+
+def process_many(
+    targets: list,
+    reference: str,
+    results_factory,
+    config: Config = Config(),
+    workers: int = None,
+    memory_limit: int = None,
+) -> list:
+    workers = workers or os.cpu_count() or 1
+    assert workers > 0
+    memory_limit = memory_limit or available_memory()
+
+    debug_line()
+    info(Code.INFO_LOADING)
+    if config.reference_preset:
+        # Every worker maps the preset files itself, the pages are shared between them.
+        # The preset is loaded here only to fail early
+        get_preset(config.reference_preset_name, config.reference_preset_folder)
+        reference_analysis = None
+    else:
+        reference_analysis = get_reference_analysis(reference, config)
+
+    reports = []
+    for target in targets:
+        try:
+            reports.append(JobReport(target, estimated_memory=estimate_memory(target, config)))
+        except Exception as e:
+            reports.append(JobReport(target, error=str(e)))
+    pending = [report for report in reports if report.error is None]
+
+    debug(
+        f"Processing {len(pending)} targets with {workers} workers"
+        + (f" and a memory limit of {memory_limit / 2 ** 20:.0f} MiB" if memory_limit else "")
+    )
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=__init_worker,
+        initargs=(__picklable_handlers(),),
+    ) as executor:
+        running = {}
+        while pending or running:
+            used_memory = sum(report.estimated_memory for report in running.values())
+            while (
+                pending
+                and len(running) < workers
+                and (
+                    not running
+                    or not memory_limit
+                    or used_memory + pending[0].estimated_memory <= memory_limit
+                )
+            ):
+                report = pending.pop(0)
+                used_memory += report.estimated_memory
+                future = executor.submit(
+                    __run_job,
+                    report.target,
+                    reference,
+                    results_factory(report.target),
+                    config,
+                    reference_analysis,
+                )
+                running[future] = report
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                report = running.pop(future)
+                try:
+                    report.completed, report.error, report.seconds = future.result()
+                except Exception as e:
+                    report.error = str(e)
+                debug(repr(report))
+
+    debug_line()
+    info(Code.INFO_COMPLETED)
+    return reports
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import platform
+import subprocess
+import numpy as np
+import scipy
+import soundfile as sf
+from time import perf_counter
+from datetime import datetime, timezone
+
+from .log import debug
+from . import Config, Result
+from .core import process
+from .tracing import TraceCollector
+
+# The spans reported for every run, the other spans are kept too
+STAGES = (
+    "process",
+    "check",
+    "analyze_levels",
+    "get_fir",
+    "convolve",
+    "correct_levels",
+    "limiter",
+    "save",
+)
+
+# Loaded on the first use or by warmup(), "import matchering" must not pull them in
+DEFERRED_MODULES = (
+    "scipy.signal",
+    "scipy.interpolate",
+    "statsmodels",
+    "matplotlib",
+    "tkinter",
+    "sqlite3",
+)
+
+
+def synthesize(
+    file: str,
+    seconds: float,
+    sample_rate: int = 44100,
+    seed: int = 0,
+    brightness: float = 1.0,
+    drive: float = 1.0,
+    block_size: int = 2 ** 18,
+) -> str:
+    # Deterministic stereo material: a bass line, a panned chord and noise hi-hats at 120 BPM.
+    # It is written block by block, so an hour of audio does not have to fit in memory
+    length = int(seconds * sample_rate)
+    with sf.SoundFile(file, "w", sample_rate, 2, "PCM_24") as f:
+        for index, start in enumerate(range(0, length, block_size)):
+            t = np.arange(start, min(length, start + block_size)) / sample_rate
+            beat = np.exp(-8 * ((t * 2) % 1))
+            eighth = np.exp(-40 * ((t * 4) % 1))
+            bass = 0.3 * beat * np.sin(2 * np.pi * 55 * t)
+            chord = sum(0.08 * np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63))
+            pan = 0.5 + 0.4 * np.sin(2 * np.pi * t / 8)
+            noise = np.random.default_rng([seed, index]).standard_normal((2, len(t)))
+            hats = 0.05 * brightness * eighth * np.diff(noise, prepend=0)
+            block = np.stack((bass + pan * chord, bass + (1 - pan) * chord)) + hats
+            f.write(0.9 * np.tanh(drive * block).T)
+    return file
+
+
+def __git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def import_time(repeat: int = 3) -> dict:
+    # "import matchering" in fresh interpreters: the best time and the deferred modules it loaded
+    script = (
+        "import sys, time; timer = time.perf_counter(); import matchering; "
+        "print(time.perf_counter() - timer); "
+        f"print(' '.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+    )
+    folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    seconds, loaded = [], []
+    for attempt in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=folder,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+        seconds.append(float(output[0]))
+        loaded = output[1].split() if len(output) > 1 else []
+    return {"seconds": min(seconds), "deferred_modules_loaded": loaded}
+
+
+def machine_info() -> dict:
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+    }
+
+
+def __summarize(collector: TraceCollector, audio_seconds: float) -> dict:
+    stages = {}
+    for span in collector.spans:
+        stage = stages.setdefault(
+            span.name, {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0}
+        )
+        stage["calls"] += 1
+        stage["wall_time"] += span.wall_time
+        stage["cpu_time"] += span.cpu_time
+    for stage in stages.values():
+        # Audio seconds per second
+        stage["throughput"] = audio_seconds / max(stage["wall_time"], 1e-9)
+    return stages
+
+
+def run_benchmark(
+    durations: list,
+    folder: str,
+    config: Config = None,
+    use_limiter: bool = True,
+    repeat: int = 1,
+    reference_seconds: float = 60,
+) -> dict:
+    # Times process() end to end and every traced stage on synthetic tracks of the given
+    # durations (in seconds). The best of the repeats is kept for every duration
+    config = config or Config(max_length=max(durations) + 60)
+    reference = synthesize(
+        os.path.join(folder, "reference.wav"),
+        reference_seconds,
+        config.internal_sample_rate,
+        seed=1,
+        brightness=2.0,
+        drive=3.0,
+    )
+
+    runs = []
+    for seconds in durations:
+        target = os.path.join(folder, f"target-{seconds:g}s.wav")
+        synthesize(target, seconds, config.internal_sample_rate)
+        result = os.path.join(folder, f"result-{seconds:g}s.wav")
+
+        best = None
+        for attempt in range(repeat):
+            collector = TraceCollector()
+            timer = perf_counter()
+            process(
+                target,
+                reference,
+                [Result(result, "PCM_16", use_limiter=use_limiter)],
+                config,
+                tracer=collector,
+            )
+            wall_time = perf_counter() - timer
+            debug(f"Benchmark: {seconds:g} s of audio is processed in {wall_time:.2f} seconds")
+            if best is None or wall_time < best["wall_time"]:
+                best = {
+                    "seconds": seconds,
+                    "wall_time": wall_time,
+                    "throughput": seconds / wall_time,
+                    "stages": __summarize(collector, seconds),
+                }
+        runs.append(best)
+        os.remove(target)
+        os.remove(result)
+    os.remove(reference)
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "commit": __git_commit(),
+        "machine": machine_info(),
+        "import": import_time(),
+        "use_limiter": use_limiter,
+        "repeat": repeat,
+        "runs": runs,
+    }
+
+
+def compare(baseline: dict, current: dict, stages: tuple = STAGES) -> list:
+    # The lines of a table: the wall times of both runs and the speedup of the current one
+    lines = [f"{'seconds':>8} {'stage':<16} {'baseline':>10} {'current':>10} {'speedup':>8}"]
+    if "import" in baseline and "import" in current:
+        old_time, new_time = baseline["import"]["seconds"], current["import"]["seconds"]
+        lines.append(
+            f"{'-':>8} {'import':<16} {old_time:>10.3f} {new_time:>10.3f} "
+            f"{old_time / max(new_time, 1e-9):>7.2f}x"
+        )
+    baseline_runs = {run["seconds"]: run for run in baseline["runs"]}
+    for run in current["runs"]:
+        old = baseline_runs.get(run["seconds"])
+        if old is None:
+            continue
+        for stage in stages:
+            if stage not in run["stages"] or stage not in old["stages"]:
+                continue
+            old_time = old["stages"][stage]["wall_time"]
+            new_time = run["stages"][stage]["wall_time"]
+            lines.append(
+                f"{run['seconds']:>8g} {stage:<16} {old_time:>10.3f} {new_time:>10.3f} "
+                f"{old_time / max(new_time, 1e-9):>7.2f}x"
+            )
+    return lines
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+from functools import lru_cache
+
+from .log import debug
+from . import Config
+from .stage_helpers import ReferenceAnalysis
+from .utils import file_hash, random_str
+
+
+def __entries(folder: str, extension: str) -> list:
+    entries = []
+    for entry in os.scandir(folder):
+        if entry.name.endswith(extension):
+            try:
+                entries.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+            except FileNotFoundError:
+                pass
+    return sorted(entries)
+
+
+def evict(folder: str, extension: str, max_size: int) -> None:
+    entries = __entries(folder, extension)
+    total_size = sum(entry_size for _, entry_size, _ in entries)
+    # The newest entry is always kept, even if it alone exceeds the limit
+    for _, entry_size, path in entries[:-1]:
+        if total_size <= max_size:
+            break
+        debug(f"Evicting '{path}' from the cache...")
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # A file that is memory-mapped by another run cannot be removed on Windows
+            debug(f"'{path}' is in use, it is kept")
+            continue
+        total_size -= entry_size
+
+
+def get_reference_cache_key(
+    reference: str, config: Config, mode: str = "process"
+) -> str:
+    # process() and process_stream() analyze the REFERENCE by different code paths
+    # (whole arrays or blocks), their entries are kept apart
+    fields = (
+        mode,
+        file_hash(reference),
+        config.internal_sample_rate,
+        config.precision,
+        config.max_piece_size,
+        config.threshold,
+        config.min_value,
+        config.fft_size,
+        config.reference_processed,
+    )
+    return hashlib.sha256(repr(fields).encode()).hexdigest()
+
+
+def load_reference_analysis(key: str, config: Config) -> ReferenceAnalysis:
+    path = os.path.join(config.reference_cache_folder, f"{key}.npz")
+    try:
+        with np.load(path) as data:
+            analysis = ReferenceAnalysis(
+                data["mid_fft"],
+                data["side_fft"],
+                float(data["match_rms"]),
+                float(data["final_amplitude_coefficient"]),
+            )
+        # Bump the modification time, it is used as the LRU order
+        os.utime(path)
+    except (OSError, KeyError, ValueError):
+        return None
+    debug(f"The REFERENCE analysis is loaded from the cache: '{path}'")
+    return analysis
+
+
+def save_reference_analysis(
+    key: str, analysis: ReferenceAnalysis, config: Config
+) -> None:
+    os.makedirs(config.reference_cache_folder, exist_ok=True)
+    path = os.path.join(config.reference_cache_folder, f"{key}.npz")
+    temp_path = f"{path}.{random_str()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.savez(
+            f,
+            mid_fft=analysis.mid_fft,
+            side_fft=analysis.side_fft,
+            match_rms=analysis.match_rms,
+            final_amplitude_coefficient=analysis.final_amplitude_coefficient,
+        )
+    os.replace(temp_path, path)
+    debug(f"The REFERENCE analysis is saved to the cache: '{path}'")
+    evict(config.reference_cache_folder, ".npz", config.reference_cache_size)
+
+
+def get_pcm_cache_folder(config: Config) -> str:
+    return os.path.join(config.temp_folder or tempfile.gettempdir(), "matchering_pcm")
+
+
+@lru_cache(maxsize=256)
+def __file_hash(file: str, modified: int, file_size: int) -> str:
+    # The modification time and the size invalidate the memoized hash
+    return file_hash(file)
+
+
+def get_pcm_cache_key(file: str, config: Config) -> str:
+    stat = os.stat(file)
+    fields = (
+        __file_hash(os.path.abspath(file), stat.st_mtime_ns, stat.st_size),
+        config.internal_sample_rate,
+        config.precision,
+    )
+    return hashlib.sha256(repr(fields).encode()).hexdigest()
+
+
+def __pcm_path(key: str, config: Config) -> str:
+    return os.path.join(get_pcm_cache_folder(config), f"{key}.npy")
+
+
+def load_pcm(key: str, config: Config) -> np.ndarray:
+    path = __pcm_path(key, config)
+    try:
+        array = np.load(path, mmap_mode="r")
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    debug(f"The decoded audio is memory-mapped from the cache: '{path}'")
+    return array
+
+
+def save_pcm(key: str, array: np.ndarray, config: Config) -> None:
+    os.makedirs(get_pcm_cache_folder(config), exist_ok=True)
+    temp_path = f"{__pcm_path(key, config)}.{random_str()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, array)
+    commit_pcm(key, temp_path, config)
+
+
+def open_pcm_writer(key: str, shape: tuple, config: Config) -> (np.ndarray, str):
+    # For filling the cache block by block, commit_pcm() publishes the result
+    os.makedirs(get_pcm_cache_folder(config), exist_ok=True)
+    temp_path = f"{__pcm_path(key, config)}.{random_str()}.tmp"
+    return (
+        np.lib.format.open_memmap(temp_path, "w+", config.precision, shape),
+        temp_path,
+    )
+
+
+def commit_pcm(key: str, temp_path: str, config: Config) -> None:
+    path = __pcm_path(key, config)
+    os.replace(temp_path, path)
+    debug(f"The decoded audio is saved to the cache: '{path}'")
+    evict(get_pcm_cache_folder(config), ".npy", config.pcm_cache_size)
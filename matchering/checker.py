@@ -18,35 +18,76 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import os
 import numpy as np
 from pedalboard.io import ReadableAudioFile
 
 from .log import Code, warning, info, debug, ModuleError
 from . import Config
-from .dsp import size, is_mono, is_stereo, mono_to_stereo, count_max_peaks
+from .dsp import (
+    size,
+    channel_count,
+    is_mono,
+    is_stereo,
+    mono_to_stereo,
+    count_max_peaks,
+)
 from .utils import time_str
+from .cache import get_pcm_cache_key, load_pcm, save_pcm
+from .fingerprint import AudioFingerprint, FingerprintBuilder
+from .tracing import traced
+
+
+def __read_planar(
+    file: ReadableAudioFile, dtype: str, block_size: int = 2 ** 18
+) -> (np.ndarray, FingerprintBuilder):
+    # pedalboard decodes to planar float32 already, other precisions are
+    # decoded block by block into one preallocated buffer
+    fingerprint = FingerprintBuilder()
+    if np.dtype(dtype) == np.float32:
+        array = file.read(file.frames)
+        fingerprint.add(array)
+        return array, fingerprint
+    array = np.empty((file.num_channels, file.frames), dtype)
+    position = 0
+    while position < file.frames:
+        block = file.read(min(block_size, file.frames - position))
+        if block.shape[1] == 0:
+            break
+        fingerprint.add(block)
+        array[:, position : position + block.shape[1]] = block
+        position += block.shape[1]
+    if position < file.frames:
+        array = np.ascontiguousarray(array[:, :position])
+    return array, fingerprint
 
 
 def __check_sample_rate(
     file: ReadableAudioFile,
     required_sample_rate: int,
+    dtype: str,
     name: str,
     log_handler,
     log_code: Code,
-) -> tuple[np.ndarray, int]:
-    
+    cached: np.ndarray = None,
+) -> (np.ndarray, int, FingerprintBuilder):
     if file.samplerate != required_sample_rate:
         debug(
             f"Resampling {name} audio from {file.samplerate} Hz to {required_sample_rate} Hz..."
         )
-        re_file = file.resampled_to(required_sample_rate)
         log_handler(log_code)
-        array = re_file.read(re_file.frames)
-        re_file.close()
-    else:
-        array = file.read(file.frames)
+        if cached is None:
+            re_file = file.resampled_to(required_sample_rate)
+            array, fingerprint = __read_planar(re_file, dtype)
+            re_file.close()
+            return array, required_sample_rate, fingerprint
+    elif cached is None:
+        array, fingerprint = __read_planar(file, dtype)
+        return array, required_sample_rate, fingerprint
 
-    return np.rot90(array,k=1,axes=(1,0)), required_sample_rate
+    fingerprint = FingerprintBuilder()
+    fingerprint.add(cached)
+    return cached, required_sample_rate, fingerprint
 
 
 def __check_length(
@@ -76,24 +117,21 @@ def __check_channels(
     return array
 
 
-def __check_clipping_limiting(
-    array: np.ndarray,
-    clipping_samples_threshold: int,
-    limited_samples_threshold: int,
-    warning_code_clipping: Code,
-    warning_code_limiting: Code,
-) -> None:
-    max_value, max_count = count_max_peaks(array)
-    if max_count > clipping_samples_threshold:
+def check_clipping_limiting(max_value: float, max_count: int, config: Config) -> None:
+    # The peaks of the TARGET are counted by its level analysis,
+    # see count_max_peaks() and PeakCounter
+    if max_count > config.clipping_samples_threshold:
         if np.isclose(max_value, 1.0):
-            warning(warning_code_clipping)
-        elif max_count > limited_samples_threshold:
-            warning(warning_code_limiting)
+            warning(Code.WARNING_TARGET_IS_CLIPPING)
+        elif max_count > config.limited_samples_threshold:
+            warning(Code.WARNING_TARGET_LIMITER_IS_APPLIED)
 
 
-def check(
+@traced("check")
+def check_with_fingerprint(
     file: ReadableAudioFile, config: Config, name: str
-) -> (np.ndarray, int):
+) -> (np.ndarray, int, AudioFingerprint):
+    # check() that also fingerprints the decoded audio, for the equality checks of process()
     name = name.upper()
 
     __check_length(
@@ -109,17 +147,27 @@ def check(
         else Code.ERROR_REFERENCE_LENGTH_LENGTH_TOO_SMALL,
     )
 
-    
-    array, sample_rate = __check_sample_rate(
+    # In-memory files have no name and are never cached
+    pcm_cache_key, cached = None, None
+    if config.pcm_cache and file.name and os.path.isfile(file.name):
+        pcm_cache_key = get_pcm_cache_key(file.name, config)
+        cached = load_pcm(pcm_cache_key, config)
+
+    array, sample_rate, fingerprint = __check_sample_rate(
         file,
         config.internal_sample_rate,
+        config.precision,
         name,
         warning if name == "TARGET" else info,
         Code.WARNING_TARGET_IS_RESAMPLED
         if name == "TARGET"
         else Code.INFO_REFERENCE_IS_RESAMPLED,
+        cached,
     )
 
+    if pcm_cache_key and cached is None:
+        save_pcm(pcm_cache_key, array, config)
+
     array = __check_channels(
         array,
         Code.INFO_TARGET_IS_MONO if name == "TARGET" else Code.INFO_REFERENCE_IS_MONO,
@@ -128,19 +176,31 @@ def check(
         else Code.ERROR_REFERENCE_NUM_OF_CHANNELS_IS_EXCEEDED,
     )
 
+    fingerprint = fingerprint.fingerprint(channel_count(array))
+    debug(f"{name} fingerprint: {fingerprint.exact}")
+    return array, sample_rate, fingerprint
 
-    if name == "TARGET":
-        __check_clipping_limiting(
-            array,
-            config.clipping_samples_threshold,
-            config.limited_samples_threshold,
-            Code.WARNING_TARGET_IS_CLIPPING,
-            Code.WARNING_TARGET_LIMITER_IS_APPLIED,
-        )
 
+def check(file: ReadableAudioFile, config: Config, name: str) -> (np.ndarray, int):
+    array, sample_rate, _ = check_with_fingerprint(file, config, name)
+    # process() warns about the clipping from its fused level analysis instead
+    if name.upper() == "TARGET":
+        check_clipping_limiting(*count_max_peaks(array), config)
     return array, sample_rate
 
 
-def check_equality(target: np.ndarray, reference: np.ndarray) -> None:
-    if target.shape == reference.shape and np.allclose(target, reference):
+def check_equality(
+    target: np.ndarray,
+    reference: np.ndarray,
+    target_fingerprint: AudioFingerprint = None,
+    reference_fingerprint: AudioFingerprint = None,
+) -> None:
+    if target.shape != reference.shape:
+        return
+    if target_fingerprint and reference_fingerprint:
+        if target_fingerprint.exact == reference_fingerprint.exact:
+            raise ModuleError(Code.ERROR_TARGET_EQUALS_REFERENCE)
+        if not target_fingerprint.may_be_close(reference_fingerprint):
+            return
+    if np.allclose(target, reference):
         raise ModuleError(Code.ERROR_TARGET_EQUALS_REFERENCE)
@@ -18,24 +18,175 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import numpy as np
+
 from .log import Code, info, debug, debug_line, ModuleError
 from . import Config, Result
 from .loader import load
 from .stages import main
-from .saver import save
-from .preview_creator import create_preview
-from .utils import get_temp_folder
-from .checker import check, check_equality
+from .saver import save_all
+from .preview_creator import get_preview_pieces, get_preview_pieces_from_window
+from .utils import get_temp_folder, file_hash
+from .stage_helpers import (
+    ReferenceAnalysis,
+    analyze_reference,
+    average_fft,
+    get_fir,
+    convolve_channel,
+)
+from .presets import get_preset
+from .limiter import limiter_pool
+from .cache import (
+    get_reference_cache_key,
+    load_reference_analysis,
+    save_reference_analysis,
+)
+from .checker import check_with_fingerprint, check_equality
+from .fingerprint import AudioFingerprint
 from .dsp import channel_count, size
+from .tracing import tracing, trace, traced
+from .fft import fft_backend
 from pedalboard.io import ReadableAudioFile
 
+def warmup(config: Config = Config(), limiter: bool = True) -> None:
+    # Loads the deferred modules, the FIR design and smoothing plans, the preset
+    # and the limiter, so the first process() call of a service is as fast as the next ones
+    debug("Warming up...")
+    noise = np.random.default_rng(0).standard_normal((2, 4 * config.fft_size))
+    noise = noise.astype(config.precision)
+    with fft_backend(config):
+        fir = get_fir(
+            noise,
+            average_fft(noise, config.internal_sample_rate, config.fft_size),
+            "mid",
+            config,
+        )
+        # Long enough for the block convolution of the full tracks
+        convolve_channel(np.resize(noise[0], 16 * config.fft_size), fir)
+    if config.reference_preset:
+        get_preset(config.reference_preset_name, config.reference_preset_folder)
+    if limiter:
+        limiter_pool.resize(config.limiter_pool_size)
+        limiter_pool.warmup()
+
+
+@traced("get_reference_analysis")
+def get_reference_analysis(
+    reference: str,
+    config: Config,
+    target: str = None,
+    target_raw: np.ndarray = None,
+    target_fingerprint: AudioFingerprint = None,
+) -> ReferenceAnalysis:
+    # is using preset?
+    if config.reference_preset:
+        debug("Config set to use preset. Reference file is ignored. ")
+        return analyze_reference(None, config)
+
+    if config.reference_cache_folder:
+        reference_cache_key = get_reference_cache_key(reference, config)
+        reference_analysis = load_reference_analysis(reference_cache_key, config)
+        if reference_analysis:
+            if target and not config.allow_equality:
+                if file_hash(target) == file_hash(reference):
+                    raise ModuleError(Code.ERROR_TARGET_EQUALS_REFERENCE)
+            return reference_analysis
+
+    f = ReadableAudioFile(reference)
+    # Analyze the reference
+    reference_raw, reference_sample_rate, reference_fingerprint = check_with_fingerprint(
+        f,  config, "reference"
+    )
+    f.close()
+
+    # Analyze the target and the reference together
+    if target_raw is not None and not config.allow_equality:
+        check_equality(
+            target_raw, reference_raw, target_fingerprint, reference_fingerprint
+        )
+
+    # Validation of the most important conditions
+    if (
+        not (reference_sample_rate == config.internal_sample_rate)
+        or not (channel_count(reference_raw) == 2)
+        or not (size(reference_raw) > config.fft_size)
+    ):
+        raise ModuleError(Code.ERROR_VALIDATION)
+
+    reference_analysis = analyze_reference(reference_raw, config)
+    del reference_raw
+
+    if config.reference_cache_folder:
+        save_reference_analysis(reference_cache_key, reference_analysis, config)
+
+    return reference_analysis
+
+
+def __preview_tasks(
+    preview_target: Result,
+    preview_result: Result,
+    target_piece: np.ndarray,
+    result_piece: np.ndarray,
+) -> list:
+    tasks = []
+    if preview_target:
+        tasks.append(
+            (
+                preview_target.file,
+                target_piece,
+                preview_target.subtype,
+                "target preview",
+                preview_target.format,
+            )
+        )
+    if preview_result:
+        tasks.append(
+            (
+                preview_result.file,
+                result_piece,
+                preview_result.subtype,
+                "result preview",
+                preview_result.format,
+            )
+        )
+    return tasks
+
+
 def process(
-    target: str,
+    target,
     reference: str,
     results: list,
     config: Config = Config(),
     preview_target: Result = None,
     preview_result: Result = None,
+    reference_analysis: ReferenceAnalysis = None,
+    preview_first: bool = False,
+    tracer=None,
+):
+    # tracer: a Tracer (e.g. TraceCollector) or a callback(phase, span),
+    # it receives the spans of the stages and the helpers of this call
+    with tracing(tracer), trace("process"), fft_backend(config):
+        return __process(
+            target,
+            reference,
+            results,
+            config,
+            preview_target,
+            preview_result,
+            reference_analysis,
+            preview_first,
+        )
+
+
+def __process(
+    target,
+    reference: str,
+    results: list,
+    config: Config,
+    preview_target: Result,
+    preview_result: Result,
+    reference_analysis: ReferenceAnalysis,
+    preview_first: bool,
 ):
     debug(
         "Please give us a star to help the project: https://github.com/sergree/matchering"
@@ -43,44 +194,56 @@ def process(
     debug_line()
     info(Code.INFO_LOADING)
 
-    if not results:
+    preview_first = preview_first and bool(preview_target or preview_result)
+    if not results and not preview_first:
         raise RuntimeError(f"The result list is empty")
 
     f = ReadableAudioFile(target)
     debug(f"Trying to load '{f.name}' with pedalboard.io...")
     # Analyze the target
-    target_raw, target_sample_rate = check(f, config, "target")
+    target_raw, target_sample_rate, target_fingerprint = check_with_fingerprint(
+        f, config, "target"
+    )
     f.close()
 
-    # is using preset?
-    if config.reference_preset:
-        debug("Config set to use preset. Reference file is ignored. ")
-        reference_raw = None
-        reference_sample_rate = config.internal_sample_rate
-    else:
-        f = ReadableAudioFile(reference)
-        # Analyze the reference
-        reference_raw, reference_sample_rate = check(
-            f,  config, "reference"
+    # Validation of the most important conditions
+    if (
+        not (target_sample_rate == config.internal_sample_rate)
+        or not (channel_count(target_raw) == 2)
+        or not (size(target_raw) > config.fft_size)
+    ):
+        raise ModuleError(Code.ERROR_VALIDATION)
+
+    if reference_analysis is None:
+        reference_analysis = get_reference_analysis(
+            reference, config, target, target_raw, target_fingerprint
         )
-        f.close()
+    elif reference and not (config.reference_preset or config.allow_equality):
+        debug("Using the precomputed REFERENCE analysis...")
+        if file_hash(target) == file_hash(reference):
+            raise ModuleError(Code.ERROR_TARGET_EQUALS_REFERENCE)
 
-        # Analyze the target and the reference together
-        if not config.allow_equality:
-            check_equality(target_raw, reference_raw)
+    # The previews are rendered from their window only and saved before the full RESULT
+    preview_reports = []
 
-        # Validation of the most important conditions
-        if (
-            not (target_sample_rate == reference_sample_rate == config.internal_sample_rate)
-            or not (channel_count(target_raw) == channel_count(reference_raw) == 2)
-            or not (size(target_raw) > config.fft_size and size(reference_raw) > config.fft_size)
-        ):
-            raise ModuleError(Code.ERROR_VALIDATION)
+    def save_previews(window: (int, int), result_piece: np.ndarray) -> None:
+        target_piece, result_piece = get_preview_pieces_from_window(
+            target_raw, result_piece, window, config
+        )
+        preview_reports.extend(
+            save_all(
+                __preview_tasks(
+                    preview_target, preview_result, target_piece, result_piece
+                ),
+                config.internal_sample_rate,
+                config.export_workers,
+            )
+        )
 
     # Process
     result, result_no_limiter, result_no_limiter_normalized = main(
         target_raw,
-        reference_raw,
+        reference_analysis,
         config,
         need_default=any(rr.use_limiter for rr in results),
         need_no_limiter=any(not rr.use_limiter and not rr.normalize for rr in results),
@@ -88,16 +251,17 @@ def process(
             not rr.use_limiter and rr.normalize for rr in results
         ),
         need_no_equalizer=any(rr.no_eq for rr in results),
+        preview_handler=save_previews if preview_first else None,
     )
 
-    del reference_raw
-    if not (preview_target or preview_result):
+    if preview_first or not (preview_target or preview_result):
         del target_raw
 
     debug_line()
     info(Code.INFO_EXPORTING)
 
     # Save
+    save_tasks = []
     for required_result in results:
         if required_result.use_limiter:
             correct_result = result
@@ -106,21 +270,38 @@ def process(
                 correct_result = result_no_limiter_normalized
             else:
                 correct_result = result_no_limiter
-        save(
-            required_result.file,
-            correct_result,
-            config.internal_sample_rate,
-            required_result.subtype,
+        save_tasks.append(
+            (
+                required_result.file,
+                correct_result,
+                required_result.subtype,
+                "result",
+                required_result.format,
+            )
         )
 
     # Creating a preview (if needed)
-    if preview_target or preview_result:
+    if (preview_target or preview_result) and not preview_first:
         result = next(
             item
             for item in [result, result_no_limiter, result_no_limiter_normalized]
             if item is not None
         )
-        create_preview(target_raw, result, config, preview_target, preview_result)
+        target_piece, result_piece = get_preview_pieces(target_raw, result, config)
         del target_raw
+        save_tasks.extend(
+            __preview_tasks(preview_target, preview_result, target_piece, result_piece)
+        )
+
+    save_reports = preview_reports + save_all(
+        save_tasks, config.internal_sample_rate, config.export_workers
+    )
+    failed_reports = [report for report in save_reports if report.error is not None]
+    if failed_reports:
+        raise RuntimeError(
+            "; ".join(f"'{report.file}': {report.error}" for report in failed_reports)
+        )
     debug_line()
     info(Code.INFO_COMPLETED)
+
+    return save_reports
@@ -74,9 +74,13 @@ class Config:
         allow_equality: bool = False,
         reference_processed: bool = False,
         reference_preset: bool = False,
+        reference_preset_name: str = "pop",
+        reference_preset_folder: str = None,
         lowess_frac: float = 0.075,
         lowess_it: int = 0,
         lowess_delta: float = 0.001,
+        smoothing: str = "lowess",
+        precision: str = "float64",
         high_filter: int = 800,
         low_filter: int = 200,
         preview_size: float = 30,
@@ -84,6 +88,14 @@ class Config:
         preview_fade_size: float = 1,
         preview_fade_coefficient: float = 8,
         temp_folder: str = None,
+        pcm_cache: bool = False,
+        pcm_cache_size: int = 2 ** 30,
+        export_workers: int = 4,
+        fft_backend: str = "scipy",
+        fft_workers: int = 1,
+        reference_cache_folder: str = None,
+        reference_cache_size: int = 64 * 2 ** 20,
+        limiter_pool_size: int = 2,
         limiter: LimiterConfig = LimiterConfig(),
     ):
         assert internal_sample_rate > 0
@@ -120,6 +132,7 @@ class Config:
         assert isinstance(lin_log_oversampling, int)
         self.lin_log_oversampling = lin_log_oversampling
 
+        # rms_correction_steps: 0 disables the RMS correction, otherwise its gain is solved exactly
         assert rms_correction_steps >= 0
         assert isinstance(rms_correction_steps, int)
         self.rms_correction_steps = rms_correction_steps
@@ -138,6 +151,10 @@ class Config:
         self.reference_processed= reference_processed
         assert isinstance(reference_preset, bool)
         self.reference_preset = reference_preset
+        assert isinstance(reference_preset_name, str)
+        assert reference_preset_folder is None or isinstance(reference_preset_folder, str)
+        self.reference_preset_name = reference_preset_name
+        self.reference_preset_folder = reference_preset_folder
 
         assert lowess_frac > 0
         assert lowess_it >= 0
@@ -147,6 +164,12 @@ class Config:
         self.lowess_it = lowess_it
         self.lowess_delta = lowess_delta
 
+        assert smoothing in ("lowess", "local_regression", "fractional_octave", "savgol")
+        self.smoothing = smoothing
+
+        assert precision in ("float64", "float32")
+        self.precision = precision
+
         assert low_filter > 0
         assert high_filter > low_filter
         self.high_filter = high_filter
@@ -164,5 +187,31 @@ class Config:
         assert temp_folder is None or isinstance(temp_folder, str)
         self.temp_folder = temp_folder
 
+        assert isinstance(pcm_cache, bool)
+        assert pcm_cache_size > 0
+        self.pcm_cache = pcm_cache
+        self.pcm_cache_size = pcm_cache_size
+
+        assert export_workers > 0
+        assert isinstance(export_workers, int)
+        self.export_workers = export_workers
+
+        # fft_workers: threads of a single FFT, -1 for all the cores
+        assert fft_backend in ("scipy", "pyfftw")
+        assert isinstance(fft_workers, int)
+        assert fft_workers != 0
+        self.fft_backend = fft_backend
+        self.fft_workers = fft_workers
+
+        assert reference_cache_folder is None or isinstance(reference_cache_folder, str)
+        assert reference_cache_size > 0
+        self.reference_cache_folder = reference_cache_folder
+        self.reference_cache_size = reference_cache_size
+
+        # limiter_pool_size: LoudMax instances kept loaded, one per concurrent job
+        assert limiter_pool_size > 0
+        assert isinstance(limiter_pool_size, int)
+        self.limiter_pool_size = limiter_pool_size
+
         assert isinstance(limiter, LimiterConfig)
         self.limiter = limiter
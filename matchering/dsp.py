@@ -19,26 +19,32 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import numpy as np
-import statsmodels.api as sm
-from scipy.signal import butter, sosfilt, freqs
-import matplotlib.pyplot as plt
 
 from matchering.defaults import Config
+from matchering.utils import lazy_import
+
+signal = lazy_import("scipy.signal")
+smoothers_lowess = lazy_import("statsmodels.nonparametric.smoothers_lowess")
+plt = lazy_import("matplotlib.pyplot")
+
+# The audio is planar and C-contiguous: (channels, samples),
+# the mid and side channels are (samples,)
+
 
 def size(array: np.ndarray) -> int:
-    return array.shape[0]
+    return array.shape[-1]
 
 
 def channel_count(array: np.ndarray) -> int:
-    return array.shape[1]
+    return array.shape[0]
 
 
 def is_mono(array: np.ndarray) -> bool:
-    return array.shape[1] == 1
+    return array.shape[0] == 1
 
 
 def is_stereo(array: np.ndarray) -> bool:
-    return array.shape[1] == 2
+    return array.shape[0] == 2
 
 
 def is_1d(array: np.ndarray) -> bool:
@@ -46,29 +52,59 @@ def is_1d(array: np.ndarray) -> bool:
 
 
 def mono_to_stereo(array: np.ndarray) -> np.ndarray:
-    return np.repeat(array, repeats=2, axis=1)
+    # A read-only view, both channels share the same memory
+    return np.broadcast_to(array, (2, size(array)))
 
 
 def count_max_peaks(array: np.ndarray) -> (float, int):
-    max_value = np.abs(array).max()
-    max_count = np.count_nonzero(
-        np.logical_or(np.isclose(array, max_value), np.isclose(array, -max_value))
-    )
+    array = np.abs(array)
+    max_value = array.max()
+    # The same as np.isclose(array, +/-max_value) with its default tolerances
+    max_count = np.count_nonzero(array >= max_value - (1e-8 + 1e-5 * max_value))
     return max_value, max_count
 
 
+class PeakCounter:
+    """count_max_peaks() over the chunks of an array, in one pass"""
+
+    def __init__(self):
+        self.max_value = 0.0
+        self.__values = np.empty(0)
+        self.__counts = np.empty(0, dtype=np.int64)
+
+    @staticmethod
+    def __threshold(max_value: float) -> float:
+        return max_value - (1e-8 + 1e-5 * max_value)
+
+    def add(self, array: np.ndarray) -> None:
+        # Only the values that may end up close to the final maximum are kept,
+        # the threshold grows with the maximum, so nothing needed is dropped.
+        # The maximum keeps the dtype of the array, just like in count_max_peaks()
+        array = np.abs(array)
+        self.max_value = max(self.max_value, array.max())
+        threshold = self.__threshold(self.max_value)
+        values, counts = np.unique(array[array >= threshold], return_counts=True)
+        keep = self.__values >= threshold
+        self.__values = np.concatenate((self.__values[keep], values))
+        self.__counts = np.concatenate((self.__counts[keep], counts))
+
+    @property
+    def max_count(self) -> int:
+        return int(self.__counts[self.__values >= self.__threshold(self.max_value)].sum())
+
+
 def lr_to_ms(array: np.ndarray) -> (np.ndarray, np.ndarray):
-    array = np.copy(array)
-    array[:, 0] += array[:, 1]
-    array[:, 0] *= 0.5
-    mid = np.copy(array[:, 0])
-    array[:, 0] -= array[:, 1]
-    side = np.copy(array[:, 0])
+    mid = array[0] + array[1]
+    mid *= 0.5
+    side = array[0] - mid
     return mid, side
 
 
 def ms_to_lr(mid_array: np.ndarray, side_array: np.ndarray) -> np.ndarray:
-    return np.vstack((mid_array + side_array, mid_array - side_array)).T
+    array = np.empty((2, size(mid_array)), np.result_type(mid_array, side_array))
+    np.add(mid_array, side_array, out=array[0])
+    np.subtract(mid_array, side_array, out=array[1])
+    return array
 
 
 def unfold(array: np.ndarray, piece_size: int, divisions: int) -> np.ndarray:
@@ -90,7 +126,8 @@ def batch_rms(array: np.ndarray) -> np.ndarray:
 
 
 def amplify(array: np.ndarray, gain: float) -> np.ndarray:
-    return array * gain
+    # A float64 gain must not upcast a float32 array
+    return array * array.dtype.type(gain)
 
 
 def normalize(
@@ -100,18 +137,18 @@ def normalize(
     max_value = np.abs(array).max()
     if max_value < threshold or normalize_clipped:
         coefficient = max(epsilon, max_value / threshold)
-    return array / coefficient, coefficient
+    return array / array.dtype.type(coefficient), coefficient
 
 
 def smooth_lowess(array: np.ndarray, frac: float, it: int, delta: float) -> np.ndarray:
-    return sm.nonparametric.lowess(
+    return smoothers_lowess.lowess(
         array, np.linspace(0, 1, len(array)), frac=frac, it=it, delta=delta
     )[:, 1]
 
 def butter_bandpass_filter(data, lowcut, highcut, fs, order=4):
     nyq = 0.5 * fs
-    sos = butter(order, [lowcut/nyq, highcut/nyq], 'band',output='sos')
-    y = sosfilt(sos, data)
+    sos = signal.butter(order, [lowcut/nyq, highcut/nyq], 'band',output='sos')
+    y = signal.sosfilt(sos, data)
 
     
     plt.semilogy(y)
@@ -131,7 +168,7 @@ def flip(array: np.ndarray) -> np.ndarray:
 
 
 def rectify(array: np.ndarray, threshold: float) -> np.ndarray:
-    rectified = np.abs(array).max(1)
+    rectified = np.abs(array).max(0)
     rectified[rectified <= threshold] = threshold
     rectified /= threshold
     return rectified
@@ -142,27 +179,29 @@ def max_mix(*args) -> np.ndarray:
 
 
 def strided_app_2d(matrix: np.ndarray, batch_size: int, step: int) -> np.ndarray:
-    matrix_length = matrix.shape[0]
-    matrix_width = matrix.shape[1]
+    # (channels, samples) -> (batch_count, channels, batch_size)
+    matrix_width, matrix_length = matrix.shape
     if batch_size > matrix_length:
         return np.expand_dims(matrix, axis=0)
     batch_count = ((matrix_length - batch_size) // step) + 1
-    stride_length, stride_width = matrix.strides
+    stride_width, stride_length = matrix.strides
     return np.lib.stride_tricks.as_strided(
         matrix,
-        shape=(batch_count, batch_size, matrix_width),
-        strides=(step * stride_length, stride_length, stride_width),
+        shape=(batch_count, matrix_width, batch_size),
+        strides=(step * stride_length, stride_width, stride_length),
     )
 
 
 def batch_rms_2d(array: np.ndarray) -> np.ndarray:
-    return batch_rms(array.reshape(array.shape[0], array.shape[1] * array.shape[2]))
+    # (batch_count, channels, batch_size) -> (batch_count,), without copying the strided batches
+    squares = np.einsum("ijk,ijk->i", array, array)
+    return np.sqrt(squares / (array.shape[1] * array.shape[2]))
 
 
 def fade(array: np.ndarray, fade_size: int) -> np.ndarray:
     array = np.copy(array)
     fade_in = np.linspace(0, 1, fade_size)
     fade_out = fade_in[::-1]
-    array[:fade_size].T[:] *= fade_in
-    array[size(array) - fade_size :].T[:] *= fade_out
+    array[:, :fade_size] *= fade_in
+    array[:, size(array) - fade_size :] *= fade_out
     return array
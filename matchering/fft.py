@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+from contextlib import contextmanager
+
+from .log import debug
+from . import Config
+from .utils import lazy_import
+
+# All the FFTs of matchering go through scipy.fft: the STFT of the analysis,
+# the FIR design and the convolutions. fft_backend() routes them to the backend
+# and the number of threads of the config
+sp_fft = lazy_import("scipy.fft")
+
+
+def next_fast_len(length: int) -> int:
+    # The smallest length >= length that the real FFTs handle quickly (5-smooth)
+    return sp_fft.next_fast_len(length, real=True)
+
+
+def fft_workers(workers: int) -> int:
+    # The same convention as scipy.fft: -1 is all the cores, -2 all but one, etc.
+    return workers if workers > 0 else max(1, (os.cpu_count() or 1) + 1 + workers)
+
+
+class PyfftwBackend:
+    """The pyFFTW interfaces as a scipy.fft backend with the threads of one job.
+    They are passed to every call, the global pyfftw.config is left alone,
+    so concurrent jobs with different fft_workers do not affect each other"""
+
+    __ua_domain__ = "numpy.scipy.fft"
+
+    def __init__(self, workers: int):
+        try:
+            import pyfftw
+            import pyfftw.interfaces.scipy_fft as pyfftw_fft
+        except ImportError:
+            raise RuntimeError(
+                "The 'pyfftw' FFT backend requires pyFFTW: pip install pyfftw"
+            )
+        # The plans are kept between the calls, the same sizes repeat for every track
+        # and the STFT frames of every track
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(10 * 60)
+        self.workers = workers
+        self.pyfftw_fft = pyfftw_fft
+
+    def __ua_function__(self, method, args, kwargs):
+        kwargs = dict(kwargs)
+        if kwargs.get("workers") is None:
+            kwargs["workers"] = self.workers
+        kwargs.setdefault("planner_effort", "FFTW_ESTIMATE")
+        return self.pyfftw_fft.__ua_function__(method, args, kwargs)
+
+
+@contextmanager
+def fft_backend(config: Config):
+    workers = fft_workers(config.fft_workers)
+    if config.fft_backend == "scipy":
+        with sp_fft.set_workers(workers):
+            yield
+        return
+    debug(f"Using the {config.fft_backend} FFT backend with {workers} threads...")
+    with sp_fft.set_workers(workers), sp_fft.set_backend(PyfftwBackend(workers)):
+        yield
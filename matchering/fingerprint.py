@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import numpy as np
+
+# The length of the envelope blocks in samples
+ENVELOPE_BLOCK_SIZE = 2 ** 14
+
+
+class AudioFingerprint:
+    """Exact and tolerant fingerprints of the decoded audio"""
+
+    def __init__(self, exact: str, envelope: np.ndarray, peak: float, shape: tuple):
+        # exact: SHA-256 of the float32 samples of every channel
+        # envelope: (channels, blocks) RMS values of ENVELOPE_BLOCK_SIZE blocks
+        self.exact = exact
+        self.envelope = envelope
+        self.peak = peak
+        self.shape = shape
+
+    @property
+    def tolerant(self) -> str:
+        # A key for near-duplicate lookups: the envelope rounded to 1 dB
+        levels = np.round(20 * np.log10(np.maximum(self.envelope, 1e-5)))
+        return hashlib.sha256(
+            repr(self.shape).encode() + levels.astype(np.int8).tobytes()
+        ).hexdigest()
+
+    def may_be_close(
+        self, other: "AudioFingerprint", rtol: float = 1e-5, atol: float = 1e-8
+    ) -> bool:
+        # False proves that np.allclose(this, other, rtol, atol) is False:
+        # a block RMS moves by at most the largest sample difference
+        if self.shape[-1] != other.shape[-1]:
+            return False
+        # The last term covers the rounding of the float32 envelopes
+        tolerance = atol + rtol * other.peak + 1e-5 * max(self.peak, other.peak)
+        return bool(np.all(np.abs(self.envelope - other.envelope) <= tolerance))
+
+    def __repr__(self):
+        return f"AudioFingerprint({self.exact[:16]}, {self.shape})"
+
+
+class FingerprintBuilder:
+    """Computes an AudioFingerprint from planar blocks of any size"""
+
+    def __init__(self):
+        self.__digests = None
+        self.__squares = None
+        self.__position = 0
+        self.__peak = 0.0
+
+    def add(self, array: np.ndarray, block_size: int = 2 ** 18) -> None:
+        if self.__digests is None:
+            self.__digests = [hashlib.sha256() for _ in array]
+            self.__squares = [[] for _ in array]
+        # Bounded temporary buffers for arrays of any length
+        for i in range(0, array.shape[-1], block_size):
+            self.__add_block(array[:, i : i + block_size])
+
+    def __add_block(self, block: np.ndarray) -> None:
+        # The head continues the last envelope block, the tail starts a new one
+        block_size = block.shape[-1]
+        head = min(-self.__position % ENVELOPE_BLOCK_SIZE, block_size)
+        body = (block_size - head) // ENVELOPE_BLOCK_SIZE * ENVELOPE_BLOCK_SIZE
+        for channel, digest, squares in zip(block, self.__digests, self.__squares):
+            digest.update(np.ascontiguousarray(channel, np.float32).data)
+            if head:
+                squares[-1] += float(channel[:head] @ channel[:head])
+            full = channel[head : head + body].reshape(-1, ENVELOPE_BLOCK_SIZE)
+            squares.extend(np.einsum("ij,ij->i", full, full).tolist())
+            tail = channel[head + body :]
+            if len(tail):
+                squares.append(float(tail @ tail))
+        self.__peak = max(self.__peak, float(block.max()), float(-block.min()))
+        self.__position += block_size
+
+    def fingerprint(self, channels: int = None) -> AudioFingerprint:
+        # A mono input can be fingerprinted as the stereo audio it becomes
+        digests, squares = self.__digests or [], self.__squares or [[]]
+        if channels and len(digests) == 1:
+            digests, squares = digests * channels, squares * channels
+        channels = len(digests)
+        exact = hashlib.sha256(repr((channels, self.__position)).encode())
+        for digest in digests:
+            exact.update(digest.digest())
+        sizes = np.minimum(
+            ENVELOPE_BLOCK_SIZE,
+            self.__position - ENVELOPE_BLOCK_SIZE * np.arange(
+                -(-self.__position // ENVELOPE_BLOCK_SIZE)
+            ),
+        )
+        envelope = np.sqrt(np.array(squares) / np.maximum(sizes, 1))
+        return AudioFingerprint(
+            exact.hexdigest(), envelope, self.__peak, (channels, self.__position)
+        )
+
+
+def fingerprint_audio(array: np.ndarray) -> AudioFingerprint:
+    builder = FingerprintBuilder()
+    builder.add(array)
+    return builder.fingerprint()
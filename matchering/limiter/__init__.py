@@ -12,3 +12,10 @@ Internal Matchering brickwall limiter based on the use of time constant and Butt
 """
 
 from .hyrax import limit
+from .loudmax import (
+    load_loudmax,
+    LoudMaxPool,
+    limiter_pool,
+    latency_samples,
+    SETTLE_SECONDS,
+)
@@ -20,13 +20,14 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 import math
-from scipy import signal
-from scipy.ndimage.filters import maximum_filter1d
 
 from .. import Config
 from ..log import debug
 from ..dsp import rectify, flip, max_mix
-from ..utils import make_odd, ms_to_samples
+from ..utils import make_odd, ms_to_samples, lazy_import
+
+signal = lazy_import("scipy.signal")
+ndimage = lazy_import("scipy.ndimage")
 
 
 def __sliding_window_fast(
@@ -34,10 +35,10 @@ def __sliding_window_fast(
 ) -> np.ndarray:
     if mode == "attack":
         window_size = make_odd(window_size)
-        return maximum_filter1d(array, size=(2 * window_size - 1))
+        return ndimage.maximum_filter1d(array, size=(2 * window_size - 1))
     half_window_size = (window_size - 1) // 2
     array = np.pad(array, (half_window_size, 0))
-    return maximum_filter1d(array, size=window_size)[:-half_window_size]
+    return ndimage.maximum_filter1d(array, size=window_size)[:-half_window_size]
 
 
 def __process_attack(array: np.ndarray, config: Config) -> (np.ndarray, np.ndarray):
@@ -96,4 +97,4 @@ def limit(array: np.ndarray, config: Config) -> np.ndarray:
     debug("Finalizing the gain envelope...")
     gain = flip(max_mix(gain_hard_clip, gain_attack, gain_release))
 
-    return array * gain[:, None]
+    return array * gain
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+from contextlib import contextmanager
+from pedalboard import Pedalboard, load_plugin
+
+from ..log import debug
+
+
+def __configure(vst) -> None:
+    # print(vst.parameters.keys())
+    vst.thresh_db = -1.0
+    vst.output_db = -0.2
+    vst.isp_detection = True
+
+
+# LoudMax does not expose its release, the audio before a cut is rendered through the limiter
+# for this long so that it has settled. The same as the release of the Hyrax limiter
+SETTLE_SECONDS = 3.0
+
+
+def latency_samples(board: Pedalboard) -> int:
+    # The lookahead of the limiter, the plugins that do not report it have none
+    return sum(getattr(plugin, "reported_latency_samples", 0) for plugin in board)
+
+
+def load_loudmax() -> Pedalboard:
+    # Make a Pedalboard object, containing multiple plugins:
+    vst = load_plugin("LoudMax.vst3")
+    debug(f"loaded {vst.name}")
+    __configure(vst)
+    return Pedalboard([vst])
+
+
+def reset_loudmax(board: Pedalboard) -> None:
+    board.reset()
+    for vst in board:
+        __configure(vst)
+
+
+class LoudMaxPool:
+    """Thread-safe pool of loaded and configured LoudMax boards"""
+
+    def __init__(self, size: int = 2):
+        assert size > 0
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.__idle = []
+        self.__lock = threading.Lock()
+
+    def resize(self, size: int) -> None:
+        assert size > 0
+        with self.__lock:
+            self.size = size
+            del self.__idle[size:]
+        debug(f"LoudMax pool size: {size}")
+
+    def warmup(self, count: int = None) -> None:
+        count = min(count or self.size, self.size)
+        while True:
+            with self.__lock:
+                if len(self.__idle) >= count:
+                    return
+            board = load_loudmax()
+            with self.__lock:
+                self.__idle.append(board)
+
+    def acquire(self) -> Pedalboard:
+        with self.__lock:
+            if self.__idle:
+                self.hits += 1
+                return self.__idle.pop()
+            self.misses += 1
+        return load_loudmax()
+
+    def release(self, board: Pedalboard) -> None:
+        reset_loudmax(board)
+        with self.__lock:
+            if len(self.__idle) < self.size:
+                self.__idle.append(board)
+
+    @contextmanager
+    def borrow(self):
+        board = self.acquire()
+        try:
+            yield board
+        finally:
+            self.release(board)
+
+
+limiter_pool = LoudMaxPool()
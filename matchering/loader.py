@@ -28,12 +28,23 @@ from .log import Code, warning, info, debug, ModuleError
 from .utils import random_file
 
 
+def __read_planar(file: str, block_size: int = 2 ** 18) -> (np.ndarray, int):
+    # (channels, samples), decoded block by block into one preallocated buffer
+    with sf.SoundFile(file) as f:
+        sound = np.empty((f.channels, f.frames))
+        for position, block in zip(
+            range(0, f.frames, block_size), f.blocks(block_size, always_2d=True)
+        ):
+            sound[:, position : position + len(block)] = block.T
+        return sound, f.samplerate
+
+
 def load(file: str, file_type: str, temp_folder: str) -> (np.ndarray, int):
     file_type = file_type.upper()
     sound, sample_rate = None, None
     debug(f"Loading the {file_type} file: '{file}'...")
     try:
-        sound, sample_rate = sf.read(file, always_2d=True)
+        sound, sample_rate = __read_planar(file)
     except RuntimeError as e:
         debug(e)
         e = str(e)
@@ -59,7 +70,7 @@ def __load_with_ffmpeg(
             subprocess.check_call(
                 ["ffmpeg", "-i", file, temp_file], stdout=devnull, stderr=devnull
             )
-            sound, sample_rate = sf.read(temp_file, always_2d=True)
+            sound, sample_rate = __read_planar(temp_file)
             if file_type == "TARGET":
                 warning(Code.WARNING_TARGET_IS_LOSSY)
             else:
@@ -77,9 +88,8 @@ def __load_with_ffmpeg(
 def save_temp(bin, temp_folder: str) -> (str):
     filename = random_file(prefix="temp",extension="mp3")
     filepath = os.path.join(temp_folder, filename)
-    temp_file = open(filepath, "wb")
-    temp_file.write(bin)
-    temp_file.close
+    with open(filepath, "wb") as temp_file:
+        temp_file.write(bin)
     return filename
 
 def get_temp_name(name: str, folder: str) -> (str,str,str):
@@ -91,10 +101,8 @@ def get_temp_name(name: str, folder: str) -> (str,str,str):
 
 def load_binary(file: str, folder: str) -> (bytes):
     filepath = os.path.join(folder, file)
-    temp_file = open(filepath, "rb")
-    result = temp_file.read()
-    temp_file.close
-    return result
+    with open(filepath, "rb") as temp_file:
+        return temp_file.read()
 
 def delete_temp(file: str, folder: str):
     filepath = os.path.join(folder, file)
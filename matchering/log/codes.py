@@ -42,6 +42,8 @@ class Code(IntEnum):
     WARNING_TARGET_LIMITER_IS_APPLIED = 3002
     WARNING_TARGET_IS_RESAMPLED = 3003
     WARNING_TARGET_IS_LOSSY = 3004
+    WARNING_SMOOTHING_IS_EXPERIMENTAL = 3005
+    WARNING_LOWESS_OPTIONS_ARE_IGNORED = 3006
 
     ERROR_TARGET_LOADING = 4001
     ERROR_TARGET_LENGTH_IS_EXCEEDED = 4002
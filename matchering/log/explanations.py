@@ -56,6 +56,10 @@ __en = {
     "The TARGET audio was resampled",
     Code.WARNING_TARGET_IS_LOSSY: "Presumably the TARGET audio format is lossy. "
     "It is highly recommended to use lossless audio formats (WAV, FLAC, AIFF)",
+    Code.WARNING_SMOOTHING_IS_EXPERIMENTAL: "The selected smoothing backend is experimental. "
+    "The matching EQ may differ from the default one by several dB",
+    Code.WARNING_LOWESS_OPTIONS_ARE_IGNORED: "The local_regression smoothing backend ignores "
+    "lowess_it and lowess_delta. It always fits like LOWESS with it=0 and delta=0",
     Code.ERROR_TARGET_LOADING: "Audio stream error in the TARGET file",
     Code.ERROR_TARGET_LENGTH_IS_EXCEEDED: "Track length is exceeded in the TARGET file",
     Code.ERROR_TARGET_LENGTH_IS_TOO_SMALL: "The track length is too small in the TARGET file",
@@ -29,7 +29,10 @@ class __LogHandlers:
     warning_handler = __dummy
     info_handler = __dummy
     debug_handler = __dummy
+    code_handler = __dummy
     explanation_handler = __dummy
+    # The arguments of the last set_handlers() call, to set the same handlers in other processes
+    arguments = {}
 
     @staticmethod
     def __check_empty(explicit_handler, default_handler):
@@ -42,12 +45,23 @@ class __LogHandlers:
         warning_handler=None,
         info_handler=None,
         debug_handler=None,
+        code_handler=None,
         show_codes=False,
     ):
+        cls.arguments = {
+            "default_handler": default_handler,
+            "warning_handler": warning_handler,
+            "info_handler": info_handler,
+            "debug_handler": debug_handler,
+            "code_handler": code_handler,
+            "show_codes": show_codes,
+        }
         default_handler = cls.__check_empty(default_handler, cls.__dummy)
         cls.warning_handler = cls.__check_empty(warning_handler, default_handler)
         cls.info_handler = cls.__check_empty(info_handler, default_handler)
         cls.debug_handler = cls.__check_empty(debug_handler, default_handler)
+        # Receives the Code of every info and warning message, not the text
+        cls.code_handler = cls.__check_empty(code_handler, cls.__dummy)
         cls.explanation_handler = get_explanation_handler(show_codes=show_codes)
 
 
@@ -56,6 +70,7 @@ def set_handlers(
     warning_handler=None,
     info_handler=None,
     debug_handler=None,
+    code_handler=None,
     show_codes=False,
 ):
     __LogHandlers.set_handlers(
@@ -63,15 +78,23 @@ def set_handlers(
         warning_handler=warning_handler,
         info_handler=info_handler,
         debug_handler=debug_handler,
+        code_handler=code_handler,
         show_codes=show_codes,
     )
 
 
+def get_handlers() -> dict:
+    # The arguments of the last set_handlers() call
+    return dict(__LogHandlers.arguments)
+
+
 def warning(*args, **kwargs):
+    __LogHandlers.code_handler(*args, **kwargs)
     __LogHandlers.warning_handler(__LogHandlers.explanation_handler(*args, **kwargs))
 
 
 def info(*args, **kwargs):
+    __LogHandlers.code_handler(*args, **kwargs)
     __LogHandlers.info_handler(__LogHandlers.explanation_handler(*args, **kwargs))
 
 
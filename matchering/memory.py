@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import threading
+import tracemalloc
+
+from .log import debug
+from . import Config, Result
+from .core import process
+from .tracing import Tracer, Span, resident_memory
+from .benchmark import synthesize
+
+# The peak of a stage in float64 copies of the stereo target, measured on a 3 min track
+# with the limiter plus a quarter for the allocator and the smaller arrays.
+# They are length-specific: the reference, the FIRs and the FFT batches do not grow with
+# the target, so the peaks shrink towards the per-sample copies on longer tracks
+# (process: 4.6 copies at 3 min, 4.0 at 15 min) and exceed the budgets below about 3 min
+DEFAULT_BUDGETS = {
+    "process": 5.75,
+    "check": 1.25,
+    "match_levels": 3.25,
+    "analyze_levels": 2.0,
+    "get_fir": 0.75,
+    "match_frequencies": 1.5,
+    "convolve": 1.25,
+    "correct_levels": 1.25,
+    "finalize": 1.25,
+    "limiter": 1.25,
+    "save": 0.25,
+}
+
+
+class MemoryTracer(Tracer):
+    """Measures the peak and retained allocations of every span with tracemalloc and RSS sampling.
+
+    The peaks between the span boundaries need tracemalloc.reset_peak() (Python 3.9+),
+    on Python 3.8 the peak and retained values are taken from the sampled RSS instead
+    """
+
+    def __init__(self, unit_size: int, rss_interval: float = 0.005):
+        # The results are given in units of unit_size bytes, e.g. copies of the target
+        self.unit_size = unit_size
+        self.rss_interval = rss_interval
+        self.stages = {}
+        self.__open = {}
+        self.__lock = threading.Lock()
+        self.__rss_max = 0
+        self.__stopped = threading.Event()
+        self.__sampler = None
+        self.__tracemalloc = hasattr(tracemalloc, "reset_peak")
+
+    @staticmethod
+    def __rss() -> int:
+        # 0 where /proc is not available
+        return resident_memory() or 0
+
+    def __sample(self) -> None:
+        while not self.__stopped.wait(self.rss_interval):
+            self.__update_rss(self.__rss())
+
+    def __update_rss(self, rss: int) -> None:
+        with self.__lock:
+            self.__rss_max = max(self.__rss_max, rss)
+
+    def __enter__(self):
+        if self.__tracemalloc:
+            tracemalloc.start()
+        else:
+            debug("tracemalloc.reset_peak() is not available, measuring the RSS only")
+        self.__stopped.clear()
+        self.__sampler = threading.Thread(target=self.__sample, daemon=True)
+        self.__sampler.start()
+        return self
+
+    def __exit__(self, *args):
+        self.__stopped.set()
+        self.__sampler.join()
+        if self.__tracemalloc:
+            tracemalloc.stop()
+
+    def __propagate(self) -> (int, int):
+        # tracemalloc and the sampler keep one peak for the whole process, so the peak since
+        # the last event is handed to every open span before it is reset.
+        # Must be called under the lock
+        rss = self.__rss()
+        rss_peak = max(self.__rss_max, rss)
+        if self.__tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        else:
+            current, peak = rss, rss_peak
+        for state in self.__open.values():
+            state["peak"] = max(state["peak"], peak)
+            state["rss_peak"] = max(state["rss_peak"], rss_peak)
+        self.__rss_max = rss
+        return current, rss
+
+    def begin(self, span: Span) -> None:
+        with self.__lock:
+            current, rss = self.__propagate()
+            self.__open[id(span)] = {
+                "current": current,
+                "peak": current,
+                "rss": rss,
+                "rss_peak": rss,
+            }
+
+    def end(self, span: Span) -> None:
+        with self.__lock:
+            current, rss = self.__propagate()
+            state = self.__open.pop(id(span))
+            stage = self.stages.setdefault(
+                span.name, {"calls": 0, "peak": 0.0, "retained": 0.0, "rss_peak": 0.0}
+            )
+            # The worst call of a stage is kept
+            stage["calls"] += 1
+            for key, value in (
+                ("peak", state["peak"] - state["current"]),
+                ("retained", current - state["current"]),
+                ("rss_peak", state["rss_peak"] - state["rss"]),
+            ):
+                stage[key] = max(stage[key], value / self.unit_size)
+
+
+def measure_memory(
+    seconds: float,
+    folder: str,
+    config: Config = None,
+    use_limiter: bool = True,
+    reference_seconds: float = None,
+) -> dict:
+    # Runs process() on a synthetic track, the results are float64 copies of the stereo target.
+    # The reference is not longer than the target, so its stages fit the same budgets
+    config = config or Config(max_length=seconds + 60)
+    reference = synthesize(
+        os.path.join(folder, "reference.wav"),
+        reference_seconds or min(60, seconds),
+        config.internal_sample_rate,
+        seed=1,
+        brightness=2.0,
+        drive=3.0,
+    )
+    target = synthesize(
+        os.path.join(folder, f"target-{seconds:g}s.wav"),
+        seconds,
+        config.internal_sample_rate,
+    )
+    result = os.path.join(folder, f"result-{seconds:g}s.wav")
+
+    input_size = 2 * int(seconds * config.internal_sample_rate) * 8
+    with MemoryTracer(input_size) as tracer:
+        process(
+            target,
+            reference,
+            [Result(result, "PCM_16", use_limiter=use_limiter)],
+            config,
+            tracer=tracer,
+        )
+    debug(f"Memory: {len(tracer.stages)} stages are measured")
+
+    for file in (reference, target, result):
+        os.remove(file)
+
+    return {
+        "seconds": seconds,
+        "input_size": input_size,
+        "use_limiter": use_limiter,
+        "stages": tracer.stages,
+    }
+
+
+def check_budgets(report: dict, budgets: dict = None) -> list:
+    # The violated budgets, an empty list if the report fits.
+    # A budget limits the tracemalloc peak of a stage in float64 copies of the target
+    budgets = DEFAULT_BUDGETS if budgets is None else budgets
+    return [
+        f"{name}: {report['stages'][name]['peak']:.2f} copies of the target at the peak, "
+        f"the budget is {budget:.2f}"
+        for name, budget in budgets.items()
+        if name in report["stages"] and report["stages"][name]["peak"] > budget
+    ]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import copy
+import json
+import threading
+import numpy as np
+
+from ..log import debug
+from .. import Config
+
+# A preset is a folder with the average mid/side spectra at several FFT resolutions
+# (mid_<fft_size>.npy, side_<fft_size>.npy) and the reference levels (level.json).
+# Each preset is loaded once per process, the spectra are memory-mapped
+PRESETS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+class Preset:
+    def __init__(
+        self,
+        name: str,
+        spectra: dict,
+        match_rms: float,
+        final_amplitude_coefficient: float,
+    ):
+        self.name = name
+        self.spectra = spectra
+        self.match_rms = match_rms
+        self.final_amplitude_coefficient = final_amplitude_coefficient
+
+    @property
+    def fft_sizes(self) -> list:
+        return sorted({fft_size for _, fft_size in self.spectra})
+
+    def spectrum(self, kind: str, fft_size: int) -> np.ndarray:
+        try:
+            return self.spectra[(kind, fft_size)]
+        except KeyError:
+            raise RuntimeError(
+                f"The '{self.name}' preset has no {kind} spectrum for fft_size={fft_size}, "
+                f"available sizes are: {self.fft_sizes}"
+            )
+
+
+__presets = {}
+__lock = threading.Lock()
+
+
+def __load(name: str, folder: str) -> Preset:
+    path = os.path.join(folder, name)
+    debug(f"Loading the '{name}' preset from '{path}'...")
+    with open(os.path.join(path, "level.json")) as f:
+        level = json.load(f)
+    spectra = {}
+    for file in os.listdir(path):
+        match = re.fullmatch(r"(mid|side)_(\d+)\.npy", file)
+        if match:
+            spectra[(match[1], int(match[2]))] = np.load(
+                os.path.join(path, file), mmap_mode="r"
+            )
+    return Preset(
+        name, spectra, level["match_rms"], level["final_amplitude_coefficient"]
+    )
+
+
+def get_preset(name: str, folder: str = None) -> Preset:
+    folder = os.path.abspath(folder or PRESETS_FOLDER)
+    with __lock:
+        if (folder, name) not in __presets:
+            __presets[(folder, name)] = __load(name, folder)
+        return __presets[(folder, name)]
+
+
+def preset_names(folder: str = None) -> list:
+    folder = folder or PRESETS_FOLDER
+    return sorted(
+        entry.name
+        for entry in os.scandir(folder)
+        if os.path.isfile(os.path.join(entry.path, "level.json"))
+    )
+
+
+def save_preset(
+    name: str,
+    reference: np.ndarray,
+    config: Config,
+    fft_sizes: tuple = (1024, 2048, 4096, 8192),
+    folder: str = None,
+) -> None:
+    from ..stage_helpers import analyze_reference
+
+    path = os.path.join(folder or PRESETS_FOLDER, name)
+    os.makedirs(path, exist_ok=True)
+    debug(f"Saving the '{name}' preset to '{path}'...")
+
+    for fft_size in fft_sizes:
+        fft_config = copy.copy(config)
+        fft_config.fft_size = fft_size
+        fft_config.reference_preset = False
+        analysis = analyze_reference(reference, fft_config)
+        np.save(os.path.join(path, f"mid_{fft_size}.npy"), analysis.mid_fft)
+        np.save(os.path.join(path, f"side_{fft_size}.npy"), analysis.side_fft)
+
+    with open(os.path.join(path, "level.json"), "w") as f:
+        json.dump(
+            {
+                "match_rms": float(analysis.match_rms),
+                "final_amplitude_coefficient": float(
+                    analysis.final_amplitude_coefficient
+                ),
+            },
+            f,
+            indent=4,
+        )
+
+    with __lock:
+        __presets.pop((os.path.abspath(folder or PRESETS_FOLDER), name), None)
@@ -18,6 +18,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import math
 import numpy as np
 
 from .log import Code, info, debug, debug_line
@@ -25,15 +26,13 @@ from .dsp import size, strided_app_2d, batch_rms_2d, fade, clip
 from . import Config, Result
 from .saver import save
 from .utils import time_str
+from .tracing import traced
 
 
-def create_preview(
-    target: np.ndarray,
-    result: np.ndarray,
-    config: Config,
-    preview_target: Result,
-    preview_result: Result,
-) -> None:
+@traced("get_preview_pieces")
+def get_preview_pieces(
+    target: np.ndarray, result: np.ndarray, config: Config
+) -> (np.ndarray, np.ndarray):
     debug_line()
     info(Code.INFO_MAKING_PREVIEWS)
 
@@ -59,14 +58,23 @@ def create_preview(
     del target, target_pieces, result_pieces
 
     debug_sample_begin = config.preview_analysis_step * int(result_loudest_piece_idx)
-    debug_sample_end = debug_sample_begin + size(result_piece)
+    __debug_window(debug_sample_begin, debug_sample_begin + size(result_piece), config)
+
+    return __fade_pieces(target_piece, result_piece, size(result), config)
+
+
+def __debug_window(start: int, end: int, config: Config) -> None:
     debug(
         f"The best part to preview: "
-        f"{time_str(debug_sample_begin, config.internal_sample_rate)} "
-        f"- {time_str(debug_sample_end, config.internal_sample_rate)}"
+        f"{time_str(start / config.internal_sample_rate)} "
+        f"- {time_str(end / config.internal_sample_rate)}"
     )
 
-    if size(result) != size(result_piece):
+
+def __fade_pieces(
+    target_piece: np.ndarray, result_piece: np.ndarray, full_size: int, config: Config
+) -> (np.ndarray, np.ndarray):
+    if full_size != size(result_piece):
         fade_size = min(
             config.preview_fade_size,
             size(result_piece) // config.preview_fade_coefficient,
@@ -75,6 +83,58 @@ def create_preview(
             result_piece, fade_size
         )
 
+    return target_piece, result_piece
+
+
+@traced("find_preview_window")
+def find_preview_window(
+    target_mid: np.ndarray, target_side: np.ndarray, config: Config
+) -> (int, int):
+    # The same windows as get_preview_pieces(), ranked by the TARGET levels:
+    # L^2 + R^2 = 2 * (M^2 + S^2), so the mid and side channels are enough
+    debug_line()
+    info(Code.INFO_MAKING_PREVIEWS)
+
+    array_size = size(target_mid)
+    preview_size, step = int(config.preview_size), int(config.preview_analysis_step)
+    if preview_size > array_size:
+        __debug_window(0, array_size, config)
+        return 0, array_size
+
+    block_size = math.gcd(preview_size, step)
+    blocks = array_size // block_size
+    energies = np.zeros(blocks + 1)
+    for channel in (target_mid, target_side):
+        unfolded = channel[: blocks * block_size].reshape(blocks, block_size)
+        energies[1:] += np.einsum("ij,ij->i", unfolded, unfolded)
+    energies = np.cumsum(energies)
+
+    window_count = (array_size - preview_size) // step + 1
+    starts = np.arange(window_count) * (step // block_size)
+    window_energies = energies[starts + preview_size // block_size] - energies[starts]
+    start = int(np.argmax(window_energies)) * step
+    __debug_window(start, start + preview_size, config)
+    return start, start + preview_size
+
+
+def get_preview_pieces_from_window(
+    target: np.ndarray, result_piece: np.ndarray, window: (int, int), config: Config
+) -> (np.ndarray, np.ndarray):
+    # The RESULT piece is already rendered for the window only
+    start, end = window
+    target_piece = clip(target[:, start:end], config.threshold)
+    return __fade_pieces(target_piece, result_piece, size(target), config)
+
+
+def create_preview(
+    target: np.ndarray,
+    result: np.ndarray,
+    config: Config,
+    preview_target: Result,
+    preview_result: Result,
+) -> None:
+    target_piece, result_piece = get_preview_pieces(target, result, config)
+
     if preview_target:
         save(
             preview_target.file,
@@ -82,6 +142,7 @@ def create_preview(
             config.internal_sample_rate,
             preview_target.subtype,
             "target preview",
+            preview_target.format,
         )
 
     if preview_result:
@@ -91,4 +152,5 @@ def create_preview(
             config.internal_sample_rate,
             preview_result.subtype,
             "result preview",
+            preview_result.format,
         )
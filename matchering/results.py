@@ -24,16 +24,23 @@ import soundfile as sf
 
 class Result:
     def __init__(
-        self, file: str, subtype: str, use_limiter: bool = True, normalize: bool = True, no_eq: bool = False
+        self, file, subtype: str, use_limiter: bool = True, normalize: bool = True, no_eq: bool = False,
+        format: str = None,
     ):
-        _, file_ext = os.path.splitext(file)
-        file_ext = file_ext[1:].upper()
+        # file: a path, or a writable binary file-like object (io.BytesIO, etc.) with
+        # the container given as format, e.g. "wav" or "mp3"
+        if isinstance(file, str):
+            _, file_ext = os.path.splitext(file)
+        elif format is None:
+            raise TypeError("The format of a file-like result must be given")
+        file_ext = (format or file_ext[1:]).upper()
         if file_ext != 'MP3':
             if not sf.check_format(file_ext):
                 raise TypeError(f"{file_ext} format is not supported")
             if not sf.check_format(file_ext, subtype):
                 raise TypeError(f"{file_ext} format does not have {subtype} subtype")
         self.file = file
+        self.format = format
         self.subtype = subtype
         self.use_limiter = use_limiter
         self.normalize = normalize
@@ -20,25 +20,91 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 import soundfile as sf
+from time import time
+from concurrent.futures import ThreadPoolExecutor
 from pedalboard.io import AudioFile
 
 from .log import debug
+from .tracing import tracing, get_tracer, traced, Tracer
 
 
-def save(
-    file: str, result: np.ndarray, sample_rate: int, subtype: str, name: str = "result"
-) -> None:
+def open_writer(
+    file, sample_rate: int, subtype: str, name: str = "result", format: str = None
+) -> AudioFile:
     name = name.upper()
     debug(f"Saving the {name} {sample_rate} Hz Stereo {subtype} to: '{file}'...")
-    
-    with AudioFile(
+
+    # A file-like object is encoded in memory, its container is given as format
+    options = {} if isinstance(file, str) else {"format": format}
+    return AudioFile(
     file,
     "w",
     samplerate=sample_rate,
     num_channels=2,
     # quality=320 if subtype == 'LAME' else None,  # kilobits per second
-    ) as f:
+    **options,
+    )
+
+
+@traced("save")
+def save(
+    file,
+    result: np.ndarray,
+    sample_rate: int,
+    subtype: str,
+    name: str = "result",
+    format: str = None,
+) -> None:
+    with open_writer(file, sample_rate, subtype, name, format) as f:
         f.write(result)
 #        sf.write(file, result, sample_rate, subtype)
     
     debug(f"'{file}' is saved")
+
+
+class SaveReport:
+    def __init__(self, file, name: str, seconds: float = 0.0, error: str = None):
+        self.file = file
+        self.name = name
+        self.seconds = seconds
+        self.error = error
+
+    def __repr__(self):
+        status = "saved" if self.error is None else f"failed: {self.error}"
+        return f"SaveReport('{self.file}', {status}, {self.seconds:.2f} s)"
+
+
+def __save_timed(
+    file,
+    result: np.ndarray,
+    sample_rate: int,
+    subtype: str,
+    name: str,
+    format: str,
+    tracer: Tracer,
+) -> SaveReport:
+    timer = time()
+    try:
+        with tracing(tracer):
+            save(file, result, sample_rate, subtype, name, format)
+    except Exception as e:
+        return SaveReport(file, name, time() - timer, str(e))
+    return SaveReport(file, name, time() - timer)
+
+
+def save_all(tasks: list, sample_rate: int, workers: int) -> list:
+    # tasks: [(file, result, subtype, name, format), ...]
+    debug(f"Encoding {len(tasks)} files with {min(workers, len(tasks))} threads...")
+    # The tracer of the caller is not inherited by the pool threads
+    tracer = get_tracer()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as executor:
+        futures = [
+            executor.submit(
+                __save_timed, file, result, sample_rate, subtype, name, format, tracer
+            )
+            for file, result, subtype, name, format in tasks
+        ]
+    reports = [future.result() for future in futures]
+    for report in reports:
+        debug(repr(report))
+    return reports
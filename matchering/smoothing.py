@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from time import time
+from functools import lru_cache
+
+from . import Config
+from .log import Code
+from .dsp import smooth_lowess
+from .utils import make_odd, lazy_import
+
+signal = lazy_import("scipy.signal")
+
+# All the backends smooth a curve sampled on the logarithmic frequency grid,
+# the window of each one spans lowess_frac of the grid, just like LOWESS does
+
+
+def __tricube(distances: np.ndarray, radius: np.ndarray) -> np.ndarray:
+    # The same cut-offs as the statsmodels LOWESS implementation
+    ratios = distances / radius
+    weights = (1 - ratios ** 3) ** 3
+    weights[ratios <= 0.001] = 1
+    weights[ratios > 0.999] = 0
+    return weights
+
+
+def __local_linear_weights(
+    rows: np.ndarray, lefts: np.ndarray, window: int
+) -> np.ndarray:
+    # Equivalent kernels of the weighted linear fits, one row per point
+    offsets = lefts[:, None] + np.arange(window) - rows[:, None]
+    radius = np.maximum(rows - lefts, lefts + window - 1 - rows)[:, None]
+    weights = __tricube(np.abs(offsets), radius)
+    s0 = weights.sum(1, keepdims=True)
+    s1 = (weights * offsets).sum(1, keepdims=True)
+    s2 = (weights * offsets ** 2).sum(1, keepdims=True)
+    return weights * (s2 - offsets * s1) / (s0 * s2 - s1 ** 2)
+
+
+@lru_cache(maxsize=16)
+def __local_regression_plan(size: int, frac: float) -> tuple:
+    # The interior points share one kernel, only the edge windows differ
+    window = min(size, max(3, int(frac * size + 1e-10)))
+    rows = np.arange(size)
+    lefts = np.clip(rows - window // 2, 0, size - window)
+    edges = lefts != rows - window // 2
+
+    edge_kernels = __local_linear_weights(rows[edges], lefts[edges], window)
+    edge_windows = lefts[edges][:, None] + np.arange(window)
+    interior_kernel = None
+    if not edges.all():
+        middle = rows[~edges][0]
+        interior_kernel = __local_linear_weights(
+            np.array([middle]), np.array([lefts[middle]]), window
+        )[0][::-1]
+    return edges, edge_kernels, edge_windows, interior_kernel, lefts[~edges]
+
+
+def smooth_local_regression(array: np.ndarray, frac: float) -> np.ndarray:
+    # Exactly LOWESS with it=0 and delta=0 on an evenly spaced grid
+    edges, edge_kernels, edge_windows, interior_kernel, interior_lefts = (
+        __local_regression_plan(len(array), frac)
+    )
+    result = np.empty(len(array))
+    result[edges] = (edge_kernels * array[edge_windows]).sum(1)
+    if interior_kernel is not None:
+        interior = signal.fftconvolve(array, interior_kernel, "valid")
+        result[~edges] = interior[interior_lefts]
+    return result
+
+
+def smooth_fractional_octave(array: np.ndarray, frac: float) -> np.ndarray:
+    # A moving average of a constant width in octaves. Like LOWESS, the edge windows
+    # are shifted inside the grid and fitted with a line, the sums come from running totals.
+    # The width is 0.74 of the LOWESS window, fitted on the curves of a 70 s track and
+    # of the default synthetic track against the pop preset
+    size = len(array)
+    window = min(size, max(3, int(0.74 * frac * size)))
+    rows = np.arange(size)
+    lefts = np.clip(rows - window // 2, 0, size - window)
+    rights = lefts + window
+
+    def window_sums(values: np.ndarray) -> np.ndarray:
+        cumulative = np.concatenate(([0], np.cumsum(values)))
+        return cumulative[rights] - cumulative[lefts]
+
+    mean_x = window_sums(rows.astype(float)) / window
+    mean_y = window_sums(array) / window
+    variance = window_sums(rows.astype(float) ** 2) / window - mean_x ** 2
+    covariance = window_sums(rows * array) / window - mean_x * mean_y
+    return mean_y + covariance / variance * (rows - mean_x)
+
+
+def smooth_savgol(array: np.ndarray, frac: float, polyorder: int = 2) -> np.ndarray:
+    # A quadratic fit needs a wider window than LOWESS for the same smoothness.
+    # The polynomial extrapolation of savgol_filter() runs away at the edges,
+    # they are taken from the linear fits of smooth_fractional_octave() instead
+    window = make_odd(max(polyorder + 2, int(1.6 * frac * len(array))))
+    window = min(window, make_odd(len(array) - 2))
+    result = signal.savgol_filter(array, window, polyorder, mode="interp")
+    edge = window // 2
+    if edge:
+        linear = smooth_fractional_octave(array, frac)
+        result[:edge] = linear[:edge]
+        result[-edge:] = linear[-edge:]
+    return result
+
+
+SMOOTHING_BACKENDS = {
+    "lowess": lambda array, config: smooth_lowess(
+        array, config.lowess_frac, config.lowess_it, config.lowess_delta
+    ),
+    "local_regression": lambda array, config: smooth_local_regression(
+        array, config.lowess_frac
+    ),
+    "fractional_octave": lambda array, config: smooth_fractional_octave(
+        array, config.lowess_frac
+    ),
+    "savgol": lambda array, config: smooth_savgol(array, config.lowess_frac),
+}
+
+
+# Faster approximations that deviate from LOWESS by several dB in places, see the README
+EXPERIMENTAL_BACKENDS = ("fractional_octave", "savgol")
+
+
+def smoothing_warnings(config: Config) -> list:
+    # The warning codes of the selected backend. "local_regression" has no robustness
+    # iterations and no interpolation, any other lowess_it or lowess_delta is ignored
+    codes = []
+    if config.smoothing in EXPERIMENTAL_BACKENDS:
+        codes.append(Code.WARNING_SMOOTHING_IS_EXPERIMENTAL)
+    if config.smoothing == "local_regression" and (
+        config.lowess_it > 0 or config.lowess_delta != Config().lowess_delta
+    ):
+        codes.append(Code.WARNING_LOWESS_OPTIONS_ARE_IGNORED)
+    return codes
+
+
+def smooth(array: np.ndarray, config: Config) -> np.ndarray:
+    return SMOOTHING_BACKENDS[config.smoothing](array, config)
+
+
+def compare_smoothing(array: np.ndarray, config: Config) -> dict:
+    # {backend: (max deviation from LOWESS in dB, RMS deviation in dB, seconds)},
+    # the magnitudes are floored at -60 dB below the peak of the LOWESS curve
+    timer = time()
+    reference = SMOOTHING_BACKENDS["lowess"](array, config)
+    floor = max(np.abs(reference).max() * 1e-3, config.min_value)
+    comparison = {"lowess": (0.0, 0.0, time() - timer)}
+    for name, backend in SMOOTHING_BACKENDS.items():
+        if name == "lowess":
+            continue
+        timer = time()
+        smoothed = backend(array, config)
+        seconds = time() - timer
+        deviation = 20 * np.log10(
+            np.maximum(np.abs(smoothed), floor) / np.maximum(np.abs(reference), floor)
+        )
+        comparison[name] = (
+            float(np.abs(deviation).max()),
+            float(np.sqrt(np.mean(deviation ** 2))),
+            seconds,
+        )
+    return comparison
@@ -14,8 +14,21 @@ Internal Matchering processing stage helpers.
 from .match_levels import (
     normalize_reference,
     analyze_levels,
+    calculate_piece_sizes,
+    calculate_rms_coefficient,
     get_average_rms,
     get_lpis_and_match_rms,
+    get_final_amplitude_coefficient,
     get_rms_c_and_amplify_pair,
+    get_rms_correction_coefficient,
+    LevelHistograms,
+    SortedLevels,
 )
-from .match_frequencies import get_fir, convolve
+from .match_frequencies import (
+    average_fft,
+    get_fir,
+    get_fir_from_spectra,
+    convolve,
+    convolve_channel,
+)
+from .reference_analysis import ReferenceAnalysis, analyze_reference
@@ -20,14 +20,22 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
 from time import time
-from scipy import signal, interpolate
+from functools import lru_cache
 
 from ..log import debug
 from .. import Config
-from ..dsp import ms_to_lr, smooth_lowess, butter_bandpass_filter
-from ..utils import debugger_is_active
-
-def __average_fft(
+from ..dsp import ms_to_lr
+from ..smoothing import smooth
+from ..utils import debugger_is_active, lazy_import
+from ..tracing import traced
+from ..fft import sp_fft
+from ..convolution import convolve_into
+
+signal = lazy_import("scipy.signal")
+interpolate = lazy_import("scipy.interpolate")
+sparse_linalg = lazy_import("scipy.sparse.linalg")
+
+def average_fft(
     loudest_pieces: np.ndarray, sample_rate: int, fft_size: int
 ) -> np.ndarray:
     *_, specs = signal.stft(
@@ -42,33 +50,54 @@ def __average_fft(
     return np.abs(specs).mean((0, 2))
 
 
-def __smooth_exponentially(matching_fft: np.ndarray, config: Config) -> np.ndarray:
-    
-    grid_linear = (
-        config.internal_sample_rate * 0.5 * np.linspace(0, 1, config.fft_size // 2 + 1)
-    )
+class FirPlan:
+    """Precomputed grids, interpolation operators and window of the FIR design"""
+
+    def __init__(self, sample_rate: int, fft_size: int, lin_log_oversampling: int):
+        grid_linear = sample_rate * 0.5 * np.linspace(0, 1, fft_size // 2 + 1)
 
-    grid_logarithmic = (
-        config.internal_sample_rate
-        * 0.5
-        * np.logspace(
-            np.log10(4 / config.fft_size),
-            0,
-            (config.fft_size // 2) * config.lin_log_oversampling + 1,
+        grid_logarithmic = (
+            sample_rate
+            * 0.5
+            * np.logspace(
+                np.log10(4 / fft_size),
+                0,
+                (fft_size // 2) * lin_log_oversampling + 1,
+            )
         )
-    )
 
-    interpolator = interpolate.interp1d(grid_linear, matching_fft, "cubic")
-    matching_fft_log = interpolator(grid_logarithmic)
+        self.to_logarithmic = self.__cubic_operator(grid_linear, grid_logarithmic)
+        self.to_linear = self.__cubic_operator(grid_logarithmic, grid_linear)
+        self.window = signal.windows.hann(fft_size)
+
+    @staticmethod
+    def __cubic_operator(grid: np.ndarray, new_grid: np.ndarray):
+        # The same not-a-knot cubic spline as interp1d(grid, values, "cubic"),
+        # with the collocation matrix factorized once for all the values
+        knots = np.concatenate(([grid[0]] * 4, grid[2:-2], [grid[-1]] * 4))
+        collocation = sparse_linalg.splu(
+            interpolate.BSpline.design_matrix(grid, knots, 3).tocsc()
+        )
+        evaluation = interpolate.BSpline.design_matrix(
+            new_grid, knots, 3, extrapolate=True
+        ).tocsr()
+        return lambda values: evaluation @ collocation.solve(values)
 
-    matching_fft_log_filtered = smooth_lowess(
-        matching_fft_log, config.lowess_frac, config.lowess_it, config.lowess_delta
-    )
 
-    interpolator = interpolate.interp1d(
-        grid_logarithmic, matching_fft_log_filtered, "cubic", fill_value="extrapolate"
-    )
-    matching_fft_filtered = interpolator(grid_linear)
+@lru_cache(maxsize=16)
+def get_fir_plan(sample_rate: int, fft_size: int, lin_log_oversampling: int) -> FirPlan:
+    debug(f"Preparing the FIR design plan for fft_size={fft_size}...")
+    return FirPlan(sample_rate, fft_size, lin_log_oversampling)
+
+
+def __smooth_exponentially(
+    matching_fft: np.ndarray, plan: FirPlan, config: Config
+) -> np.ndarray:
+    matching_fft_log = plan.to_logarithmic(matching_fft)
+
+    matching_fft_log_filtered = smooth(matching_fft_log, config)
+
+    matching_fft_filtered = plan.to_linear(matching_fft_log_filtered)
 
     matching_fft_filtered[0] = 0
     
@@ -76,26 +105,35 @@ def __smooth_exponentially(matching_fft: np.ndarray, config: Config) -> np.ndarr
     return matching_fft_filtered
 
 
+def __limit_boosts(array: np.ndarray, start: int, end: int, to: float = None) -> None:
+    # Halves (or clamps to the given value) the bins in [start, end) that boost the signal
+    segment = array[start:end]
+    boosts = segment > 1
+    segment[boosts] = 0.5 * segment[boosts] if to is None else to
+
+
+@traced("get_fir")
 def get_fir(
     target_loudest_pieces: np.ndarray,
-    reference_loudest_pieces: np.ndarray,
+    reference_average_fft: np.ndarray,
     name: str,
     config: Config,
 ) -> np.ndarray:
     debug(f"Calculating the {name} FIR for the matching EQ...")
 
-    target_average_fft = __average_fft(
+    target_average_fft = average_fft(
         target_loudest_pieces, config.internal_sample_rate, config.fft_size
     )
-    
-    if config.reference_preset:
-        reference_average_fft = np.load('ref_'+ name +'.npy')
-    else:
-        reference_average_fft = __average_fft(
-            reference_loudest_pieces, config.internal_sample_rate, config.fft_size
-        )
-    # np.save('ref_'+ name +'.npy',reference_average_fft)
 
+    return get_fir_from_spectra(target_average_fft, reference_average_fft, name, config)
+
+
+def get_fir_from_spectra(
+    target_average_fft: np.ndarray,
+    reference_average_fft: np.ndarray,
+    name: str,
+    config: Config,
+) -> np.ndarray:
     fft_size = config.internal_sample_rate/2/len(reference_average_fft)
     
     
@@ -117,34 +155,28 @@ def get_fir(
 
     np.maximum(config.min_value, target_average_fft, out=target_average_fft)
     matching_fft = reference_average_fft / target_average_fft
+    high_filter_bin = int(config.high_filter/fft_size)
     if name == "mid":
         # if the target is poor in low range, avoid boosting
         if target_true_peak > config.low_filter/fft_size:
-            for x in range(target_true_peak):
-                if matching_fft[x] > 1:
-                    matching_fft[x] = 0.5 * matching_fft[x]
+            __limit_boosts(matching_fft, 0, target_true_peak)
         # don't boost mid frequency, avoid muddiness
-        for x in range(int(target_peak*1.5),int(config.high_filter/fft_size)):
-            if matching_fft[x] > 1:
-                matching_fft[x] = 1
+        __limit_boosts(matching_fft, int(target_peak*1.5), high_filter_bin, to=1)
         # high filter, taming filter for more natural character of music
-        for x in range(int(config.high_filter/fft_size),len(matching_fft)):
-            if matching_fft[x] > 1:
-                matching_fft[x] = 0.5 * matching_fft[x]
+        __limit_boosts(matching_fft, high_filter_bin, len(matching_fft))
     if name == "side":
         # don't boost low/mid range, avoid muddiness
-        for x in range(int(max(config.high_filter/fft_size, target_true_peak))):
-            if matching_fft[x] > 1:
-                matching_fft[x] = 1
+        __limit_boosts(matching_fft, 0, int(max(config.high_filter/fft_size, target_true_peak)), to=1)
         # high filter, taming filter for more natural character of music, leave out high freq air
-        for x in range(int(config.high_filter/fft_size),int(len(matching_fft)/2)):
-            if matching_fft[x] > 1:
-                matching_fft[x] = 0.5 * matching_fft[x]
+        __limit_boosts(matching_fft, high_filter_bin, int(len(matching_fft)/2))
 
-    matching_fft_filtered = __smooth_exponentially(matching_fft, config)
+    plan = get_fir_plan(
+        config.internal_sample_rate, config.fft_size, config.lin_log_oversampling
+    )
+    matching_fft_filtered = __smooth_exponentially(matching_fft, plan, config)
 
-    fir = np.fft.irfft(matching_fft_filtered)
-    fir = np.fft.ifftshift(fir) * signal.windows.hann(len(fir))
+    fir = sp_fft.irfft(matching_fft_filtered)
+    fir = np.fft.ifftshift(fir) * plan.window
 
     """ import matplotlib.pyplot as plt
     if debugger_is_active():
@@ -165,6 +197,15 @@ def get_fir(
     return fir
 
 
+@traced("convolve")
+def convolve_channel(
+    array: np.ndarray, fir: np.ndarray, out: np.ndarray = None
+) -> np.ndarray:
+    # The same as signal.fftconvolve(array, fir, "same"), written into out if given
+    return convolve_into(array, fir.astype(array.dtype), out)
+
+
+@traced("convolve_pair")
 def convolve(
     target_mid: np.ndarray,
     mid_fir: np.ndarray,
@@ -173,11 +214,12 @@ def convolve(
 ) -> (np.ndarray, np.ndarray):
     debug("Convolving the TARGET audio with calculated FIRs...")
     timer = time()
-    result_mid = signal.fftconvolve(target_mid, mid_fir, "same")
-    result_side = signal.fftconvolve(target_side, side_fir, "same")
+    result_mid = convolve_channel(target_mid, mid_fir)
+    result_side = convolve_channel(target_side, side_fir)
     debug(f"The convolution is done in {time() - timer:.2f} seconds")
 
     debug("Converting MS to LR...")
     result = ms_to_lr(result_mid, result_side)
 
     return result, result_mid
+
@@ -23,15 +23,24 @@ import numpy as np
 from ..log import debug
 from .. import Config
 from ..utils import to_db
-from ..dsp import lr_to_ms, size, unfold, batch_rms, rms, amplify, normalize
+from ..dsp import size, unfold, batch_rms, rms, amplify, PeakCounter
+from ..tracing import traced
 
 
 def normalize_reference(reference: np.ndarray, config: Config) -> (np.ndarray, float):
+    final_amplitude_coefficient = get_final_amplitude_coefficient(
+        np.abs(reference).max(), config
+    )
+    return reference / final_amplitude_coefficient, final_amplitude_coefficient
+
+
+def get_final_amplitude_coefficient(max_value: float, config: Config) -> float:
+    # The coefficient of normalize(reference, normalize_clipped=False), from the peak only
     debug("Normalizing the REFERENCE...")
 
-    reference, final_amplitude_coefficient = normalize(
-        reference, config.threshold, config.min_value, normalize_clipped=False
-    )
+    final_amplitude_coefficient = 1.0
+    if max_value < config.threshold:
+        final_amplitude_coefficient = max(config.min_value, max_value / config.threshold)
 
     if np.isclose(final_amplitude_coefficient, 1.0):
         debug("The REFERENCE was not changed. There is no final amplitude coefficient")
@@ -41,13 +50,12 @@ def normalize_reference(reference: np.ndarray, config: Config) -> (np.ndarray, f
             f"Final amplitude coefficient for the TARGET audio is: {to_db(final_amplitude_coefficient)}"
         )
 
-    return reference, final_amplitude_coefficient
+    return final_amplitude_coefficient
 
 
-def __calculate_piece_sizes(
-    array: np.ndarray, max_piece_size: int, name: str, sample_rate: int
+def calculate_piece_sizes(
+    array_size: int, max_piece_size: int, name: str, sample_rate: int
 ) -> (int, int, int):
-    array_size = size(array)
     divisions = int(array_size / max_piece_size) + 1
     debug(f"The {name} will be didived into {divisions} pieces")
 
@@ -103,7 +111,7 @@ def get_average_rms(
     return unfolded_array, rmses, average_rms
 
 
-def __calculate_rms_coefficient(
+def calculate_rms_coefficient(
     array_match_rms: float, reference_match_rms: float, epsilon: float
 ) -> float:
     rms_coefficient = reference_match_rms / max(epsilon, array_match_rms)
@@ -120,7 +128,7 @@ def get_rms_c_and_amplify_pair(
     name: str,
 ) -> (float, np.ndarray, np.ndarray):
     name = name.upper()
-    rms_coefficient = __calculate_rms_coefficient(
+    rms_coefficient = calculate_rms_coefficient(
         array_main_match_rms, reference_match_rms, epsilon
     )
 
@@ -131,26 +139,173 @@ def get_rms_c_and_amplify_pair(
     return rms_coefficient, array_main, array_additional
 
 
+def get_rms_correction_coefficient(
+    levels, reference_match_rms: float, config: Config
+) -> float:
+    # The gain at which the loudest pieces of the clipped result have the match RMS of the
+    # REFERENCE, the fixed point that the correction steps used to approach.
+    # levels: SortedLevels or LevelHistograms of the result, rms_correction_steps=0 disables it
+    if not config.rms_correction_steps:
+        return 1.0
+    debug("Applying RMS correction...")
+    coefficient = levels.gain(reference_match_rms, config.min_value)
+    debug(f"The RMS correction coefficient is: {to_db(coefficient)}")
+    return coefficient
+
+
+class LevelHistograms:
+    """Per-piece magnitude histograms for estimating clipped RMS values on the fly"""
+
+    edges = np.logspace(-4, 2, 1024 + 1)
+
+    def __init__(self, divisions: int, piece_size: int):
+        self.__divisions = divisions
+        self.__piece_size = piece_size
+        self.__position = 0
+        self.__counts = np.zeros((divisions, len(self.edges) - 1))
+        self.__squares = np.zeros((divisions, len(self.edges) - 1))
+
+    def __loudest_pieces(self) -> (np.ndarray, np.ndarray):
+        # The pieces that are louder than average before clipping
+        rmses = np.sqrt(self.__squares.sum(axis=1) / self.__piece_size)
+        loudest_piece_idxs, _ = get_lpis_and_match_rms(rmses, rms(rmses))
+        return self.__counts[loudest_piece_idxs], self.__squares[loudest_piece_idxs]
+
+    def add(self, array: np.ndarray) -> None:
+        bins = len(self.edges) - 1
+        pieces = (self.__position + np.arange(len(array))) // self.__piece_size
+        self.__position += len(array)
+        inside = pieces < self.__divisions
+        if not inside.any():
+            return
+        array, pieces = np.abs(array[inside]), pieces[inside]
+        first_piece, piece_count = pieces[0], pieces[-1] - pieces[0] + 1
+        idxs = (pieces - first_piece) * bins + np.clip(
+            np.searchsorted(self.edges, array) - 1, 0, bins - 1
+        )
+        pieces_slice = slice(first_piece, first_piece + piece_count)
+        self.__counts[pieces_slice] += np.bincount(
+            idxs, minlength=piece_count * bins
+        ).reshape(piece_count, bins)
+        self.__squares[pieces_slice] += np.bincount(
+            idxs, weights=array * array, minlength=piece_count * bins
+        ).reshape(piece_count, bins)
+
+    def gain(self, match_rms: float, epsilon: float, iterations: int = 64) -> float:
+        # The match RMS of the clipped loudest pieces grows with the gain,
+        # the gain is bisected between the unclipped solution and 2 ** 20 times it
+        counts, squares = self.__loudest_pieces()
+        levels = np.sqrt(squares / np.maximum(counts, 1))
+        sample_count = len(counts) * self.__piece_size
+
+        def clipped_rms(gain: float) -> float:
+            # The bins with gain * level >= 1 are clipped to 1, the rest are amplified
+            clipped_squares = np.where(gain * levels >= 1, counts, gain * gain * squares)
+            return np.sqrt(clipped_squares.sum() / sample_count)
+
+        low = match_rms / max(epsilon, np.sqrt(squares.sum() / sample_count))
+        high = low * 2 ** 20
+        if clipped_rms(high) < match_rms:
+            return high
+        for _ in range(iterations):
+            middle = np.sqrt(low * high)
+            if clipped_rms(middle) < match_rms:
+                low = middle
+            else:
+                high = middle
+        return high
+
+
+class SortedLevels:
+    """Sorted squared samples of the loudest pieces for solving the clipped RMS exactly"""
+
+    def __init__(self, array: np.ndarray, divisions: int, piece_size: int):
+        # Only the pieces that are louder than average before clipping count in the match RMS,
+        # their samples are pooled: the match RMS is the RMS of all of them
+        unfolded = unfold(array, piece_size, divisions)
+        rmses = batch_rms(unfolded)
+        loudest_piece_idxs, _ = get_lpis_and_match_rms(rmses, rms(rmses))
+        self.__squares = unfolded[loudest_piece_idxs].reshape(-1)
+        np.square(self.__squares, out=self.__squares)
+        self.__squares.sort()
+        self.__cumulative = np.cumsum(self.__squares)
+
+    def __clipping_sum(self, count: int) -> float:
+        # The sum of the clipped squares at the gain where the sample #count starts clipping:
+        # the quieter samples are amplified, this one and the louder ones are 1
+        if count == len(self.__squares):
+            return -np.inf
+        if self.__squares[count] == 0:
+            return np.inf
+        unclipped = self.__cumulative[count - 1] if count else 0.0
+        return unclipped / self.__squares[count] + len(self.__squares) - count
+
+    def gain(self, match_rms: float, epsilon: float) -> float:
+        # The clipped sum grows with the gain. The bisection finds the number of unclipped
+        # samples at the solution, then gain ** 2 * unclipped sum + clipped count = target
+        target = match_rms ** 2 * len(self.__squares)
+        low, high = 0, len(self.__squares)
+        while low < high:
+            middle = (low + high) // 2
+            if self.__clipping_sum(middle) <= target:
+                high = middle
+            else:
+                low = middle + 1
+        if low == 0:
+            # Even the quietest sample clips
+            return float(1 / np.sqrt(self.__squares[0]))
+        unclipped = self.__cumulative[low - 1]
+        clipped = len(self.__squares) - low
+        return float(np.sqrt((target - clipped) / max(unclipped, epsilon ** 2)))
+
+
+def __analyze_chunks(
+    array: np.ndarray, divisions: int, piece_size: int, chunk_size: int = 2 ** 16
+) -> (np.ndarray, np.ndarray, np.ndarray, PeakCounter):
+    # One pass in cache-sized chunks: mid, side, the squares of the mid pieces and the peaks
+    mid = np.empty(size(array), array.dtype)
+    side = np.empty(size(array), array.dtype)
+    squares = np.zeros(divisions)
+    peaks = PeakCounter()
+    for start in range(0, size(array), chunk_size):
+        end = min(start + chunk_size, size(array))
+        chunk_mid, chunk_side = mid[start:end], side[start:end]
+        np.add(array[0, start:end], array[1, start:end], out=chunk_mid)
+        chunk_mid *= 0.5
+        np.subtract(array[0, start:end], chunk_mid, out=chunk_side)
+        peaks.add(array[:, start:end])
+
+        last_piece = min(end, divisions * piece_size) - 1
+        for piece in range(start // piece_size, last_piece // piece_size + 1):
+            piece_mid = chunk_mid[
+                max(start, piece * piece_size) - start : min(end, (piece + 1) * piece_size) - start
+            ]
+            squares[piece] += piece_mid @ piece_mid
+    return mid, side, squares, peaks
+
+
+@traced("analyze_levels")
 def analyze_levels(
     array: np.ndarray, name: str, config: Config
-) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray, float, float, float):
+) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray, float, int, int, float, int):
     name = name.upper()
-    debug(f"Calculating mid and side channels of the {name}...")
-    mid, side = lr_to_ms(array)
-    del array
-
-
-    array_size, divisions, piece_size = __calculate_piece_sizes(
-        mid, config.max_piece_size, name, config.internal_sample_rate
+    array_size, divisions, piece_size = calculate_piece_sizes(
+        size(array), config.max_piece_size, name, config.internal_sample_rate
     )
 
-    unfolded_mid, rmses, average_rms = get_average_rms(mid, piece_size, divisions, name)
+    debug(f"Calculating mid and side channels, peaks and RMSes of the {name} pieces...")
+    mid, side, squares, peaks = __analyze_chunks(array, divisions, piece_size)
+    del array
+
+    rmses = np.sqrt(squares / piece_size)
+    average_rms = rms(rmses)
+    unfolded_mid = unfold(mid, piece_size, divisions)
     unfolded_side = unfold(side, piece_size, divisions)
 
-    if name == "reference" and config.reference_processed:
+    if name == "REFERENCE" and config.reference_processed:
         debug("Using processed reference as a whole")
-        mid_loudest_pieces = mid
-        side_loudest_pieces = side
+        mid_loudest_pieces = unfolded_mid
+        side_loudest_pieces = unfolded_side
         match_rms = average_rms
     else:
         mid_loudest_pieces, side_loudest_pieces, match_rms = __extract_loudest_pieces(
@@ -166,8 +321,6 @@ def analyze_levels(
         match_rms,
         divisions,
         piece_size,
+        peaks.max_value,
+        peaks.max_count,
     )
-
-def preset_level(name: str = "PRESET") -> (float, float):
-    if name == "PRESET":
-        return 0.282, 1 # -11 db
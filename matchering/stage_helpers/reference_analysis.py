@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from ..log import debug
+from .. import Config
+from ..presets import get_preset
+from .match_levels import get_final_amplitude_coefficient, analyze_levels
+from .match_frequencies import average_fft
+from ..tracing import traced
+
+
+class ReferenceAnalysis:
+    def __init__(
+        self,
+        mid_fft: np.ndarray,
+        side_fft: np.ndarray,
+        match_rms: float,
+        final_amplitude_coefficient: float,
+    ):
+        self.mid_fft = mid_fft
+        self.side_fft = side_fft
+        self.match_rms = match_rms
+        self.final_amplitude_coefficient = final_amplitude_coefficient
+
+
+@traced("analyze_reference")
+def analyze_reference(reference: np.ndarray, config: Config) -> ReferenceAnalysis:
+    if config.reference_preset:
+        preset = get_preset(config.reference_preset_name, config.reference_preset_folder)
+        debug(f"Using the levels and spectra of the '{preset.name}' preset...")
+        return ReferenceAnalysis(
+            preset.spectrum("mid", config.fft_size),
+            preset.spectrum("side", config.fft_size),
+            preset.match_rms,
+            preset.final_amplitude_coefficient,
+        )
+
+    # The levels and spectra scale with the amplitude, so the REFERENCE is
+    # analyzed as it is and normalized afterwards, without a normalized copy
+    (
+        _,
+        _,
+        mid_loudest_pieces,
+        side_loudest_pieces,
+        match_rms,
+        *_,
+        max_value,
+        _,
+    ) = analyze_levels(reference, "reference", config)
+    final_amplitude_coefficient = get_final_amplitude_coefficient(max_value, config)
+
+    debug("Calculating the average spectra of the REFERENCE...")
+    mid_fft = average_fft(
+        mid_loudest_pieces, config.internal_sample_rate, config.fft_size
+    )
+    side_fft = average_fft(
+        side_loudest_pieces, config.internal_sample_rate, config.fft_size
+    )
+    return ReferenceAnalysis(
+        mid_fft / final_amplitude_coefficient,
+        side_fft / final_amplitude_coefficient,
+        match_rms / final_amplitude_coefficient,
+        final_amplitude_coefficient,
+    )
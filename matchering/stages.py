@@ -18,39 +18,41 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from sqlite3 import Time
-from tkinter import NO
 import numpy as np
+from time import time
+from contextlib import nullcontext
 
-from matchering.stage_helpers.match_levels import preset_level
-from .log import Code, info, debug, debug_line
+from .log import Code, info, warning, debug, debug_line
 from . import Config
 from .utils import to_db, debugger_is_active
-from .dsp import amplify, normalize, clip, ms_to_lr
+from .dsp import size, amplify, normalize, ms_to_lr
 from .stage_helpers import (
-    normalize_reference,
     analyze_levels,
     get_fir,
-    convolve,
-    get_average_rms,
-    get_lpis_and_match_rms,
+    convolve_channel,
     get_rms_c_and_amplify_pair,
+    get_rms_correction_coefficient,
+    SortedLevels,
+    ReferenceAnalysis,
 )
-from .limiter import limit
-from pedalboard import Pedalboard, Limiter, load_plugin
+from .limiter import limit, limiter_pool, latency_samples, SETTLE_SECONDS
+from .checker import check_clipping_limiting
+from .smoothing import smoothing_warnings
+from .preview_creator import find_preview_window
+from .tracing import traced, trace
 
 
+@traced("match_levels")
 def __match_levels(
-    target: np.ndarray, reference: np.ndarray, config: Config
+    target: np.ndarray, reference_analysis: ReferenceAnalysis, config: Config
 ) -> (
     np.ndarray,
     np.ndarray,
     float,
     np.ndarray,
     np.ndarray,
-    np.ndarray,
-    np.ndarray,
-    float,
+    int,
+    int,
     float,
 ):
     debug_line()
@@ -69,23 +71,14 @@ def __match_levels(
         target_match_rms,
         target_divisions,
         target_piece_size,
+        target_max_value,
+        target_max_count,
     ) = analyze_levels(target, "target", config)
 
-    reference_mid_loudest_pieces = None
-    reference_side_loudest_pieces = None
-    if config.reference_preset:
-        reference_match_rms, final_amplitude_coefficient = preset_level()
-    else:
-        reference, final_amplitude_coefficient = normalize_reference(reference, config)
+    check_clipping_limiting(target_max_value, target_max_count, config)
 
-        (
-            reference_mid,
-            reference_side,
-            reference_mid_loudest_pieces,
-            reference_side_loudest_pieces,
-            reference_match_rms,
-            *_,
-        ) = analyze_levels(reference, "reference", config)
+    reference_match_rms = reference_analysis.match_rms
+    final_amplitude_coefficient = reference_analysis.final_amplitude_coefficient
 
     rms_coefficient, target_mid, target_side = get_rms_c_and_amplify_pair(
         target_mid,
@@ -106,80 +99,114 @@ def __match_levels(
         final_amplitude_coefficient,
         target_mid_loudest_pieces,
         target_side_loudest_pieces,
-        reference_mid_loudest_pieces,
-        reference_side_loudest_pieces,
         target_divisions,
         target_piece_size,
         reference_match_rms,
     )
 
 
+@traced("match_frequencies")
 def __match_frequencies(
     target_mid: np.ndarray,
-    target_side: np.ndarray,
     target_mid_loudest_pieces: np.ndarray,
-    reference_mid_loudest_pieces: np.ndarray,
     target_side_loudest_pieces: np.ndarray,
-    reference_side_loudest_pieces: np.ndarray,
+    reference_analysis: ReferenceAnalysis,
     config: Config,
 ) -> (np.ndarray, np.ndarray):
     debug_line()
     info(Code.INFO_MATCHING_FREQS)
+    for code in smoothing_warnings(config):
+        warning(code)
 
     mid_fir = get_fir(
-        target_mid_loudest_pieces, reference_mid_loudest_pieces, "mid", config
+        target_mid_loudest_pieces, reference_analysis.mid_fft, "mid", config
     )
     side_fir = get_fir(
-        target_side_loudest_pieces, reference_side_loudest_pieces, "side", config
+        target_side_loudest_pieces, reference_analysis.side_fft, "side", config
     )
 
     del (
         target_mid_loudest_pieces,
-        reference_mid_loudest_pieces,
         target_side_loudest_pieces,
-        reference_side_loudest_pieces,
     )
 
-    result, result_mid = convolve(target_mid, mid_fir, target_side, side_fir)
+    # The side channel is convolved later, the level correction needs the mid only
+    debug("Convolving the TARGET mid channel with the calculated FIR...")
+    timer = time()
+    result_mid = convolve_channel(target_mid, mid_fir)
+    debug(f"The convolution is done in {time() - timer:.2f} seconds")
 
-    return result, result_mid
+    return result_mid, side_fir
 
 
+@traced("correct_levels")
 def __correct_levels(
-    result: np.ndarray,
     result_mid: np.ndarray,
     target_divisions: int,
     target_piece_size: int,
     reference_match_rms: float,
     config: Config,
-) -> np.ndarray:
+) -> float:
     debug_line()
     info(Code.INFO_CORRECTING_LEVELS)
 
-    for step in range(1, config.rms_correction_steps + 1):
-        debug(f"Applying RMS correction #{step}...")
-        result_mid_clipped = clip(result_mid)
+    levels = SortedLevels(result_mid, target_divisions, target_piece_size)
+    rms_coefficient = get_rms_correction_coefficient(
+        levels, reference_match_rms, config
+    )
+    del levels
 
-        _, clipped_rmses, clipped_average_rms = get_average_rms(
-            result_mid_clipped, target_piece_size, target_divisions, "result"
-        )
+    return rms_coefficient
 
-        _, result_mid_clipped_match_rms = get_lpis_and_match_rms(
-            clipped_rmses, clipped_average_rms
-        )
 
-        rms_coefficient, result_mid, result = get_rms_c_and_amplify_pair(
-            result_mid,
-            result,
-            result_mid_clipped_match_rms,
-            reference_match_rms,
-            config.min_value,
-            "result",
+@traced("render_preview")
+def __render_preview(
+    target_mid: np.ndarray,
+    target_side: np.ndarray,
+    result_mid: np.ndarray,
+    side_fir: np.ndarray,
+    rms_coefficient: float,
+    use_limiter: bool,
+    normalize_result: bool,
+    config: Config,
+) -> ((int, int), np.ndarray):
+    start, end = find_preview_window(target_mid, target_side, config)
+
+    with limiter_pool.borrow() if use_limiter else nullcontext() as board:
+        # The margins cover the FIR and the lookahead of the limiter,
+        # the pre-roll lets the limiter settle before the window
+        latency = latency_samples(board) if board is not None else 0
+        pre_roll = (
+            config.fft_size
+            + latency
+            + int(SETTLE_SECONDS * config.internal_sample_rate)
+        )
+        post_roll = config.fft_size + latency
+        low, high = max(0, start - pre_roll), min(size(target_mid), end + post_roll)
+        debug(
+            f"Rendering the RESULT preview with {(start - low) / config.internal_sample_rate:.2f} "
+            f"seconds of pre-roll..."
         )
 
-    return result
+        result_side = target_side[low:high]
+        if side_fir is not None:
+            result_side = convolve_channel(result_side, side_fir)
+        piece = ms_to_lr(result_mid[low:high], result_side)
+        piece *= rms_coefficient
 
+        if board is not None:
+            with trace("limiter", array=piece):
+                piece = board(piece, config.internal_sample_rate)
+    piece = np.ascontiguousarray(piece[:, start - low : end - low])
 
+    if normalize_result:
+        # The peak of the whole RESULT is not known yet, the piece is normalized by its own
+        piece, _ = normalize(piece, config.threshold, config.min_value, normalize_clipped=True)
+
+    return (start, end), piece
+
+
+@traced("finalize")
 def __finalize(
     result_no_limiter: np.ndarray,
     final_amplitude_coefficient: float,
@@ -208,29 +235,20 @@ def __finalize(
             )
 
     result = None
-    # Make a Pedalboard object, containing multiple plugins:
-    vst = load_plugin("LoudMax.vst3")
-    debug(f"loaded {vst.name}")
-    # print(vst.parameters.keys())
-    vst.thresh_db = -1.0
-    vst.output_db = -0.2
-    vst.isp_detection = True
-    board = Pedalboard([vst])
     if need_default:
-        result = board(result_no_limiter, config.internal_sample_rate)
+        with limiter_pool.borrow() as board, trace("limiter", array=result_no_limiter):
+            result = board(result_no_limiter, config.internal_sample_rate)
         # result = limit(result_no_limiter, config)
         # result = amplify(result, final_amplitude_coefficient)
-    del board
-    del vst
 
     """ import matplotlib.pyplot as plt
     from datetime import timedelta
     if debugger_is_active():
         preview = int(result_no_limiter.argmax().max()/2)
         fig, (ax_orig, ax_mag) = plt.subplots(2, 1)
-        ax_orig.plot(result_no_limiter[max(preview-5000,0):min(preview+5000,len(result_no_limiter)),0])
+        ax_orig.plot(result_no_limiter[0,max(preview-5000,0):min(preview+5000,result_no_limiter.shape[-1])])
         ax_orig.set_title(str(timedelta(seconds=int(preview/config.internal_sample_rate)))+' before limiter')
-        ax_mag.plot(result[max(preview-5000,0):min(preview+5000,len(result)),0])
+        ax_mag.plot(result[0,max(preview-5000,0):min(preview+5000,result.shape[-1])])
         ax_mag.set_title('after limiter')
         fig.tight_layout()
     # if __debug__:
@@ -243,63 +261,93 @@ def __finalize(
 
 def main(
     target: np.ndarray,
-    reference: np.ndarray,
+    reference_analysis: ReferenceAnalysis,
     config: Config,
     need_default: bool = True,
     need_no_limiter: bool = False,
     need_no_limiter_normalized: bool = False,
     need_no_equalizer: bool = False,
+    preview_handler=None,
 ) -> (np.ndarray, np.ndarray, np.ndarray):
+    # preview_handler(window, result_piece) is called before the full RESULT is rendered
     (
         target_mid,
         target_side,
         final_amplitude_coefficient,
         target_mid_loudest_pieces,
         target_side_loudest_pieces,
-        reference_mid_loudest_pieces,
-        reference_side_loudest_pieces,
         target_divisions,
         target_piece_size,
         reference_match_rms,
-    ) = __match_levels(target, reference, config)
+    ) = __match_levels(target, reference_analysis, config)
 
+    rms_coefficient = 1.0
     if need_no_equalizer:
         debug("Bypassing equalizer")
-        result_no_limiter = ms_to_lr(target_mid, target_side)
-        result_no_limiter_mid = target_mid
-    else: 
-        result_no_limiter, result_no_limiter_mid = __match_frequencies(
+        result_mid, side_fir = target_mid, None
+    else:
+        result_mid, side_fir = __match_frequencies(
             target_mid,
-            target_side,
             target_mid_loudest_pieces,
-            reference_mid_loudest_pieces,
             target_side_loudest_pieces,
-            reference_side_loudest_pieces,
+            reference_analysis,
+            config,
+        )
+        rms_coefficient = __correct_levels(
+            result_mid,
+            target_divisions,
+            target_piece_size,
+            reference_match_rms,
             config,
         )
 
     del (
         target,
-        reference,
-        target_mid,
-        target_side,
         target_mid_loudest_pieces,
-        reference_mid_loudest_pieces,
         target_side_loudest_pieces,
-        reference_side_loudest_pieces,
     )
 
-    if not need_no_equalizer:
-        result_no_limiter = __correct_levels(
-            result_no_limiter,
-            result_no_limiter_mid,
-            target_divisions,
-            target_piece_size,
-            reference_match_rms,
-            config,
+    if preview_handler:
+        # The same RESULT as the one get_preview_pieces() would choose from
+        need_any_limiter = need_default or not (need_no_limiter or need_no_limiter_normalized)
+        preview_window, result_preview = __render_preview(
+            target_mid,
+            target_side,
+            result_mid,
+            side_fir,
+            rms_coefficient,
+            use_limiter=need_any_limiter,
+            normalize_result=not (need_any_limiter or need_no_limiter),
+            config=config,
         )
+        preview_handler(preview_window, result_preview)
+        del result_preview
+
+    if not (need_default or need_no_limiter or need_no_limiter_normalized):
+        debug("The full RESULT is not required")
+        return None, None, None
 
-    del result_no_limiter_mid
+    # The side channel is convolved right into the RESULT, MS to LR is done in place
+    result_no_limiter = np.empty(
+        (2, size(target_side)), np.result_type(result_mid, target_side)
+    )
+    if side_fir is not None:
+        debug("Convolving the TARGET side channel with the calculated FIR...")
+        timer = time()
+        convolve_channel(target_side, side_fir, out=result_no_limiter[1])
+        debug(f"The convolution is done in {time() - timer:.2f} seconds")
+    else:
+        result_no_limiter[1] = target_side
+    del target_mid, target_side
+
+    debug("Converting MS to LR...")
+    np.add(result_mid, result_no_limiter[1], out=result_no_limiter[0])
+    np.subtract(result_mid, result_no_limiter[1], out=result_no_limiter[1])
+    del result_mid
+
+    if not need_no_equalizer:
+        debug(f"Modifying the amplitudes of the RESULT audio by {to_db(rms_coefficient)}...")
+        result_no_limiter *= rms_coefficient
 
     result, result_no_limiter, result_no_limiter_normalized = __finalize(
         result_no_limiter,
@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import numpy as np
+from contextlib import ExitStack
+from itertools import tee
+from pedalboard.io import ReadableAudioFile
+
+from .log import Code, warning, info, debug, debug_line, ModuleError
+from . import Config
+from .dsp import (
+    size,
+    is_mono,
+    is_stereo,
+    mono_to_stereo,
+    PeakCounter,
+    lr_to_ms,
+    ms_to_lr,
+    rms,
+    amplify,
+)
+from .saver import open_writer
+from .convolution import convolve_blocks
+from .limiter import limiter_pool, latency_samples
+from .stage_helpers import (
+    calculate_piece_sizes,
+    calculate_rms_coefficient,
+    get_lpis_and_match_rms,
+    get_final_amplitude_coefficient,
+    get_rms_correction_coefficient,
+    LevelHistograms,
+    average_fft,
+    get_fir_from_spectra,
+    ReferenceAnalysis,
+    analyze_reference,
+)
+from .cache import (
+    get_reference_cache_key,
+    load_reference_analysis,
+    save_reference_analysis,
+    get_pcm_cache_key,
+    load_pcm,
+    open_pcm_writer,
+    commit_pcm,
+)
+from .checker import check_clipping_limiting
+from .smoothing import smoothing_warnings
+from .fingerprint import AudioFingerprint, FingerprintBuilder
+from .utils import time_str, to_db, file_hash
+from .fft import fft_backend
+
+
+def __check(file: str, name: str, config: Config) -> int:
+    with ReadableAudioFile(file) as f:
+        debug(f"Trying to load '{f.name}' with pedalboard.io...")
+        debug(f"{name} audio length: {time_str(f.duration)}")
+        if f.duration < config.fft_size / f.samplerate:
+            raise ModuleError(
+                Code.ERROR_TARGET_LENGTH_IS_TOO_SMALL
+                if name == "TARGET"
+                else Code.ERROR_REFERENCE_LENGTH_LENGTH_TOO_SMALL
+            )
+
+        if f.num_channels == 1:
+            info(
+                Code.INFO_TARGET_IS_MONO
+                if name == "TARGET"
+                else Code.INFO_REFERENCE_IS_MONO
+            )
+        elif f.num_channels != 2:
+            raise ModuleError(
+                Code.ERROR_TARGET_NUM_OF_CHANNELS_IS_EXCEEDED
+                if name == "TARGET"
+                else Code.ERROR_REFERENCE_NUM_OF_CHANNELS_IS_EXCEEDED
+            )
+
+        if f.samplerate == config.internal_sample_rate:
+            return f.frames
+
+        debug(
+            f"Resampling {name} audio from {f.samplerate} Hz to {config.internal_sample_rate} Hz..."
+        )
+        if name == "TARGET":
+            warning(Code.WARNING_TARGET_IS_RESAMPLED)
+        else:
+            info(Code.INFO_REFERENCE_IS_RESAMPLED)
+        with f.resampled_to(config.internal_sample_rate) as re_file:
+            return re_file.frames
+
+
+def __decode_blocks(file: str, config: Config, block_size: int, pcm_cache_key: str):
+    with ReadableAudioFile(file) as f:
+        re_file = (
+            f
+            if f.samplerate == config.internal_sample_rate
+            else f.resampled_to(config.internal_sample_rate)
+        )
+        writer, temp_path, position = None, None, 0
+        try:
+            if pcm_cache_key:
+                writer, temp_path = open_pcm_writer(
+                    pcm_cache_key, (re_file.num_channels, re_file.frames), config
+                )
+            while True:
+                block = re_file.read(block_size)
+                if block.shape[1] == 0:
+                    break
+                block = block.astype(config.precision, copy=False)
+                if writer is not None and position + size(block) <= size(writer):
+                    writer[:, position : position + size(block)] = block
+                position += size(block)
+                yield block
+            if writer is not None and position == size(writer):
+                writer.flush()
+                # The memory map is closed with its last reference, before the file is moved
+                writer = None
+                commit_pcm(pcm_cache_key, temp_path, config)
+                temp_path = None
+        finally:
+            # Windows cannot remove a file that is still mapped
+            writer = None
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            if re_file is not f:
+                re_file.close()
+
+
+def __read_blocks(file: str, config: Config, block_size: int):
+    pcm_cache_key, cached = None, None
+    if config.pcm_cache:
+        pcm_cache_key = get_pcm_cache_key(file, config)
+        cached = load_pcm(pcm_cache_key, config)
+
+    blocks = (
+        __decode_blocks(file, config, block_size, pcm_cache_key)
+        if cached is None
+        else (cached[:, i : i + block_size] for i in range(0, size(cached), block_size))
+    )
+    for block in blocks:
+        if is_mono(block):
+            block = mono_to_stereo(block)
+        elif not is_stereo(block):
+            raise ModuleError(Code.ERROR_VALIDATION)
+        yield block
+
+
+def __analyze(
+    file: str, name: str, config: Config, block_size: int
+) -> (np.ndarray, np.ndarray, float, float, int, int, int, AudioFingerprint):
+    name = name.upper()
+    array_size = __check(file, name, config)
+    _, divisions, piece_size = calculate_piece_sizes(
+        array_size, config.max_piece_size, name, config.internal_sample_rate
+    )
+
+    debug(f"Analyzing the {name} piece by piece...")
+    rmses = np.zeros(divisions)
+    mid_spectra = np.zeros((divisions, config.fft_size // 2 + 1))
+    side_spectra = np.zeros((divisions, config.fft_size // 2 + 1))
+    piece = np.empty((2, piece_size), config.precision)
+    piece_idx, filled = 0, 0
+    peaks = PeakCounter()
+    fingerprint = FingerprintBuilder()
+
+    for block in __read_blocks(file, config, block_size):
+        fingerprint.add(block)
+        peaks.add(block)
+
+        while size(block) and piece_idx < divisions:
+            taken = min(size(block), piece_size - filled)
+            piece[:, filled : filled + taken] = block[:, :taken]
+            block = block[:, taken:]
+            filled += taken
+            if filled == piece_size:
+                mid, side = lr_to_ms(piece)
+                rmses[piece_idx] = rms(mid)
+                mid_spectra[piece_idx] = average_fft(
+                    mid[None], config.internal_sample_rate, config.fft_size
+                )
+                side_spectra[piece_idx] = average_fft(
+                    side[None], config.internal_sample_rate, config.fft_size
+                )
+                piece_idx, filled = piece_idx + 1, 0
+
+    if name == "REFERENCE" and config.reference_processed:
+        debug("Using processed reference as a whole")
+        loudest_piece_idxs, match_rms = slice(None), rms(rmses)
+    else:
+        debug(
+            f"Extracting the loudest pieces of the {name} audio "
+            f"with the RMS value more than average {to_db(rms(rmses))}..."
+        )
+        loudest_piece_idxs, match_rms = get_lpis_and_match_rms(rmses, rms(rmses))
+
+    return (
+        mid_spectra[loudest_piece_idxs].mean(0),
+        side_spectra[loudest_piece_idxs].mean(0),
+        match_rms,
+        peaks.max_value,
+        peaks.max_count,
+        divisions,
+        piece_size,
+        fingerprint.fingerprint(),
+    )
+
+
+def __analyze_reference(
+    file: str, config: Config, block_size: int
+) -> (ReferenceAnalysis, AudioFingerprint):
+    mid_fft, side_fft, match_rms, max_value, *_, fingerprint = __analyze(
+        file, "reference", config, block_size
+    )
+
+    final_amplitude_coefficient = get_final_amplitude_coefficient(max_value, config)
+
+    return (
+        ReferenceAnalysis(
+            mid_fft / final_amplitude_coefficient,
+            side_fft / final_amplitude_coefficient,
+            match_rms / final_amplitude_coefficient,
+            final_amplitude_coefficient,
+        ),
+        fingerprint,
+    )
+
+
+def __render(
+    file: str, config: Config, block_size: int, gain: float, firs: list = None
+):
+    blocks = (lr_to_ms(block) for block in __read_blocks(file, config, block_size))
+    blocks = ((amplify(mid, gain), amplify(side, gain)) for mid, side in blocks)
+    if not firs:
+        return blocks
+    # The convolution tail is kept in the last block so that only it can be tiny
+    mids, sides = tee(blocks)
+    return zip(
+        convolve_blocks((mid for mid, _ in mids), firs[0].astype(config.precision)),
+        convolve_blocks((side for _, side in sides), firs[1].astype(config.precision)),
+    )
+
+
+def __limit(board, array: np.ndarray, sample_rate: int) -> np.ndarray:
+    # Tiny buffers confuse the channel layout detection, and only the last one can be tiny
+    if size(array) < 3:
+        array = np.concatenate(
+            (array, np.zeros((2, 3 - size(array)), array.dtype)), axis=1
+        )
+    return board(array.astype(np.float32), sample_rate, reset=False)
+
+
+def __export(
+    board,
+    writers: list,
+    blocks,
+    correction_coefficient: float,
+    normalized_coefficient: float,
+    config: Config,
+    block_size: int,
+) -> None:
+    # The limiter delays its output by its latency. The samples that pedalboard
+    # does not hold back itself are dropped at the start, and the end is flushed with silence
+    delay = latency_samples(board) if board else 0
+    if delay:
+        debug(f"The limiter latency is {delay} samples")
+    written_size, limited_size = 0, 0
+    for result_mid, result_side in blocks:
+        result_no_limiter = amplify(
+            ms_to_lr(result_mid, result_side), correction_coefficient
+        )
+        written_size += size(result_no_limiter)
+
+        result = None
+        if board:
+            result = __limit(board, result_no_limiter, config.internal_sample_rate)
+            delay -= min(delay, max(0, size(result_no_limiter) - size(result)))
+            dropped = min(delay, size(result))
+            result = result[:, dropped : dropped + written_size - limited_size]
+            delay -= dropped
+            limited_size += size(result)
+
+        for required_result, writer in writers:
+            if required_result.use_limiter:
+                writer.write(result)
+            elif required_result.normalize:
+                writer.write(amplify(result_no_limiter, 1 / normalized_coefficient))
+            else:
+                writer.write(result_no_limiter)
+
+    if board:
+        debug("Flushing the limiter...")
+        while limited_size < written_size:
+            result = board(
+                np.zeros((2, block_size), dtype=np.float32),
+                config.internal_sample_rate,
+                reset=False,
+            )
+            dropped = min(delay, size(result))
+            result = result[:, dropped : dropped + written_size - limited_size]
+            delay -= dropped
+            if not size(result) and not dropped:
+                break
+            limited_size += size(result)
+            for required_result, writer in writers:
+                if required_result.use_limiter:
+                    writer.write(result)
+
+
+def process_stream(
+    target: str,
+    reference: str,
+    results: list,
+    config: Config = Config(),
+    block_size: int = 2 ** 17,
+):
+    with fft_backend(config):
+        return __process_stream(target, reference, results, config, block_size)
+
+
+def __process_stream(
+    target: str,
+    reference: str,
+    results: list,
+    config: Config,
+    block_size: int,
+):
+    debug(
+        "Please give us a star to help the project: https://github.com/sergree/matchering"
+    )
+    debug_line()
+    info(Code.INFO_LOADING)
+
+    if not results:
+        raise RuntimeError(f"The result list is empty")
+
+    assert block_size >= config.fft_size
+
+    debug(
+        f"Streaming mode: the audio is processed in blocks of {block_size} samples, "
+        f"the maximum length is not limited"
+    )
+
+    need_default = any(rr.use_limiter for rr in results)
+    need_no_equalizer = any(rr.no_eq for rr in results)
+
+    debug_line()
+    info(Code.INFO_MATCHING_LEVELS)
+
+    (
+        target_mid_fft,
+        target_side_fft,
+        target_match_rms,
+        target_max_value,
+        target_max_count,
+        target_divisions,
+        target_piece_size,
+        target_fingerprint,
+    ) = __analyze(target, "target", config, block_size)
+
+    check_clipping_limiting(target_max_value, target_max_count, config)
+
+    reference_analysis, reference_fingerprint = None, None
+    if config.reference_preset:
+        debug("Config set to use preset. Reference file is ignored. ")
+        reference_analysis = analyze_reference(None, config)
+    elif config.reference_cache_folder:
+        reference_cache_key = get_reference_cache_key(reference, config, "stream")
+        reference_analysis = load_reference_analysis(reference_cache_key, config)
+
+    if not reference_analysis:
+        reference_analysis, reference_fingerprint = __analyze_reference(
+            reference, config, block_size
+        )
+        if config.reference_cache_folder:
+            save_reference_analysis(reference_cache_key, reference_analysis, config)
+
+    if not config.allow_equality and not config.reference_preset:
+        # The whole audio is never in memory here, so only the exact match is checked
+        if reference_fingerprint:
+            is_equal = target_fingerprint.exact == reference_fingerprint.exact
+        else:
+            is_equal = file_hash(target) == file_hash(reference)
+        if is_equal:
+            raise ModuleError(Code.ERROR_TARGET_EQUALS_REFERENCE)
+
+    reference_match_rms = reference_analysis.match_rms
+
+    rms_coefficient = calculate_rms_coefficient(
+        target_match_rms, reference_match_rms, config.min_value
+    )
+
+    if need_no_equalizer:
+        debug("Bypassing equalizer")
+        firs = None
+        correction_coefficient = 1.0
+        peak = rms_coefficient * target_max_value
+    else:
+        debug_line()
+        info(Code.INFO_MATCHING_FREQS)
+        for code in smoothing_warnings(config):
+            warning(code)
+
+        debug(f"Calculating the mid FIR for the matching EQ...")
+        mid_fir = get_fir_from_spectra(
+            target_mid_fft * rms_coefficient, reference_analysis.mid_fft, "mid", config
+        )
+        debug(f"Calculating the side FIR for the matching EQ...")
+        side_fir = get_fir_from_spectra(
+            target_side_fft * rms_coefficient, reference_analysis.side_fft, "side", config
+        )
+        firs = [mid_fir, side_fir]
+
+        debug_line()
+        info(Code.INFO_CORRECTING_LEVELS)
+
+        debug("Convolving the TARGET audio with calculated FIRs...")
+        histograms = LevelHistograms(target_divisions, target_piece_size)
+        peak = 0.0
+        for result_mid, result_side in __render(
+            target, config, block_size, rms_coefficient, firs
+        ):
+            histograms.add(result_mid)
+            peak = max(peak, (np.abs(result_mid) + np.abs(result_side)).max())
+
+        correction_coefficient = get_rms_correction_coefficient(
+            histograms, reference_match_rms, config
+        )
+        debug(f"The total RMS correction is: {to_db(correction_coefficient)}")
+        peak *= correction_coefficient
+
+    debug_line()
+    info(Code.INFO_FINALIZING)
+
+    normalized_coefficient = max(config.min_value, peak / config.threshold)
+    debug(
+        f"The amplitude of the normalized RESULT should be adjusted by {to_db(normalized_coefficient)}"
+    )
+    board = limiter_pool.acquire() if need_default else None
+
+    debug_line()
+    info(Code.INFO_EXPORTING)
+
+    writers = []
+    try:
+        for required_result in results:
+            writers.append(
+                (
+                    required_result,
+                    open_writer(
+                        required_result.file,
+                        config.internal_sample_rate,
+                        required_result.subtype,
+                        format=required_result.format,
+                    ),
+                )
+            )
+        __export(
+            board,
+            writers,
+            __render(target, config, block_size, rms_coefficient, firs),
+            correction_coefficient,
+            normalized_coefficient,
+            config,
+            block_size,
+        )
+    finally:
+        # The board goes back to the pool even if a writer fails to close
+        with ExitStack() as stack:
+            for required_result, writer in writers:
+                stack.callback(writer.close)
+            if board:
+                limiter_pool.release(board)
+
+    for required_result, writer in writers:
+        debug(f"'{required_result.file}' is saved")
+
+    debug_line()
+    info(Code.INFO_COMPLETED)
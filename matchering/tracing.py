@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""
+Matchering - Audio Matching and Mastering Python Library
+Copyright (C) 2016-2022 Sergree
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import inspect
+import threading
+import numpy as np
+from time import perf_counter, thread_time
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+def resident_memory() -> int:
+    # The current resident memory of the process, None where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class Span:
+    """One call of a traced stage or helper"""
+
+    def __init__(self, name: str, attributes: dict, memory: int):
+        self.name = name
+        # The shapes of the array arguments, the file names, etc.
+        self.attributes = attributes
+        self.thread = threading.get_ident()
+        self.start = perf_counter()
+        self.wall_time = None
+        self.cpu_time = thread_time()
+        # The resident memory of the process at the start and its peak during the span
+        self.start_memory = memory
+        self.peak_memory = memory
+        # The peak during the span above the start, None where the memory is unknown
+        self.peak_memory_delta = None
+        self.error = None
+
+    def sample(self, memory: int) -> None:
+        if memory is not None and self.peak_memory is not None:
+            self.peak_memory = max(self.peak_memory, memory)
+
+    def finish(self, memory: int) -> None:
+        self.wall_time = perf_counter() - self.start
+        self.cpu_time = thread_time() - self.cpu_time
+        self.sample(memory)
+        if self.peak_memory is not None:
+            self.peak_memory_delta = self.peak_memory - self.start_memory
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "thread": self.thread,
+            "start": self.start,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_memory_delta": self.peak_memory_delta,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def __repr__(self):
+        return f"Span('{self.name}', {self.wall_time:.4f} s)"
+
+
+class Tracer:
+    """Receives the spans of process(), begin() before a call and end() after it"""
+
+    def begin(self, span: Span) -> None:
+        pass
+
+    def end(self, span: Span) -> None:
+        pass
+
+
+class CallbackTracer(Tracer):
+    """A tracer from a callback(phase, span), the phase is "begin" or "end" """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def begin(self, span: Span) -> None:
+        self.callback("begin", span)
+
+    def end(self, span: Span) -> None:
+        self.callback("end", span)
+
+
+class TraceCollector(Tracer):
+    """Collects the finished spans and dumps them as JSON or Chrome trace events"""
+
+    def __init__(self):
+        self.spans = []
+        self.__lock = threading.Lock()
+        self.__origin = perf_counter()
+
+    def end(self, span: Span) -> None:
+        with self.__lock:
+            self.spans.append(span)
+
+    def to_json(self) -> list:
+        spans = [span.to_dict() for span in self.spans]
+        for span in spans:
+            span["start"] -= self.__origin
+        return spans
+
+    def to_chrome_trace(self) -> dict:
+        # Complete events in microseconds, open the file in chrome://tracing or Perfetto
+        return {
+            "traceEvents": [
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": (span.start - self.__origin) * 1e6,
+                    "dur": span.wall_time * 1e6,
+                    "pid": os.getpid(),
+                    "tid": span.thread,
+                    "args": {
+                        "cpu_time": span.cpu_time,
+                        "peak_memory_delta": span.peak_memory_delta,
+                        "error": span.error,
+                        **span.attributes,
+                    },
+                }
+                for span in self.spans
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def dump(self, file: str, format: str = "json") -> None:
+        assert format in ("json", "chrome")
+        with open(file, "w") as f:
+            json.dump(self.to_json() if format == "json" else self.to_chrome_trace(), f)
+
+
+class MemorySampler:
+    """Samples the resident memory while spans are open and keeps the peak of each of them"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.__spans = set()
+        self.__lock = threading.Lock()
+        self.__stopped = None
+
+    def __run(self, stopped: threading.Event) -> None:
+        while not stopped.wait(self.interval):
+            memory = resident_memory()
+            with self.__lock:
+                for span in self.__spans:
+                    span.sample(memory)
+
+    def open(self, span: Span) -> None:
+        if span.start_memory is None:
+            return
+        with self.__lock:
+            self.__spans.add(span)
+            if self.__stopped is None:
+                # One thread for all the open spans, it stops with the last of them
+                self.__stopped = threading.Event()
+                threading.Thread(
+                    target=self.__run, args=(self.__stopped,), daemon=True
+                ).start()
+
+    def close(self, span: Span) -> None:
+        with self.__lock:
+            self.__spans.discard(span)
+            if not self.__spans and self.__stopped is not None:
+                self.__stopped.set()
+                self.__stopped = None
+
+
+__sampler = MemorySampler()
+
+# Every thread and task has its own tracer, threads started by process() are given it explicitly
+__active_tracer = ContextVar("matchering_tracer", default=None)
+
+
+def get_tracer() -> Tracer:
+    return __active_tracer.get()
+
+
+@contextmanager
+def tracing(tracer):
+    # tracer: a Tracer, a callback(phase, span) or None, None keeps the current one
+    if tracer is not None and not isinstance(tracer, Tracer):
+        tracer = CallbackTracer(tracer)
+    token = __active_tracer.set(tracer or __active_tracer.get())
+    try:
+        yield tracer
+    finally:
+        __active_tracer.reset(token)
+
+
+def __describe(value):
+    if isinstance(value, np.ndarray):
+        return list(value.shape)
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return None
+
+
+@contextmanager
+def trace(name: str, /, **attributes):
+    tracer = __active_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    attributes = {key: __describe(value) for key, value in attributes.items()}
+    span = Span(
+        name,
+        {key: value for key, value in attributes.items() if value is not None},
+        resident_memory(),
+    )
+    __sampler.open(span)
+    tracer.begin(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = repr(e)
+        raise
+    finally:
+        __sampler.close(span)
+        span.finish(resident_memory())
+        tracer.end(span)
+
+
+def traced(name: str):
+    # Traces every call of the function, its array and scalar arguments become attributes
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if __active_tracer.get() is None:
+                return function(*args, **kwargs)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            with trace(name, **arguments):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
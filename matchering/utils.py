@@ -19,6 +19,8 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 import sys 
 import os
+import importlib
+import hashlib
 import random
 import string
 import math
@@ -30,6 +32,14 @@ def get_temp_folder(results: list) -> str:
     return os.path.dirname(os.path.abspath(first_result_file))
 
 
+def file_hash(file: str, chunk_size: int = 2 ** 20) -> str:
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def random_str(size: int = 16) -> str:
     return "".join(random.choices(string.ascii_lowercase + string.digits, k=size))
 
@@ -58,6 +68,26 @@ def make_odd(value: int) -> int:
 def time_str(length) -> str:
     return str(timedelta(seconds=length))
 
+class LazyModule:
+    """A module that is imported on the first access to its attributes"""
+
+    def __init__(self, name: str):
+        self.__name = name
+
+    def __getattr__(self, attribute: str):
+        # The import system caches and locks the module, so this is cheap and thread-safe
+        return getattr(importlib.import_module(self.__name), attribute)
+
+    def __repr__(self):
+        return f"LazyModule('{self.__name}')"
+
+
+def lazy_import(name: str) -> LazyModule:
+    # scipy.signal, statsmodels and matplotlib take seconds to import,
+    # so they are loaded when a function needs them or by warmup()
+    return LazyModule(name)
+
+
 def debugger_is_active() -> bool:
     """Return if the debugger is currently active"""
     return hasattr(sys, 'gettrace') and sys.gettrace() is not None
\ No newline at end of file
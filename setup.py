@@ -3,6 +3,9 @@ from setuptools import setup, find_packages
 with open("requirements.txt") as f:
     requirements = f.read().splitlines()
 
+with open("requirements-app.txt") as f:
+    app_requirements = f.read().splitlines()
+
 with open("README.md", "r") as fh:
     long_description = fh.read()
 
@@ -15,9 +18,12 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     install_requires=requirements,
+    # main-app.py: pip install matchering[app]
+    extras_require={"app": app_requirements},
     license="GPLv3",
     url="https://github.com/sergree/matchering",
     packages=find_packages(include=["matchering", "matchering.*"]),
+    package_data={"matchering": ["presets/*/*.npy", "presets/*/*.json"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Programming Language :: Python :: 3",
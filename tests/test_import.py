@@ -0,0 +1,26 @@
+import pytest
+
+from matchering.benchmark import DEFERRED_MODULES, import_time
+
+# "import matchering" took 2.2 s when it loaded scipy.signal, statsmodels and matplotlib,
+# 0.2 s without them. The bound leaves room for slow machines and still catches an eager import
+IMPORT_SECONDS = 1.0
+
+
+@pytest.fixture(scope="module")
+def report():
+    return import_time(repeat=3)
+
+
+def test_deferred_modules_are_not_imported(report):
+    assert report["deferred_modules_loaded"] == [], (
+        f"import matchering loads {', '.join(report['deferred_modules_loaded'])}, "
+        f"they must be imported on the first use"
+    )
+
+
+def test_import_time(report):
+    assert report["seconds"] < IMPORT_SECONDS, (
+        f"import matchering takes {report['seconds']:.2f} s, "
+        f"the bound is {IMPORT_SECONDS:.2f} s"
+    )
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from matchering.stage_helpers import LevelHistograms, SortedLevels
+
+DIVISIONS = 5
+PIECE_SIZE = 44100 * 12
+
+
+@pytest.fixture(scope="module")
+def result_mid():
+    # Pieces of noise at different levels, the loud ones clip at the higher match RMSes
+    rng = np.random.default_rng(0)
+    levels = np.repeat(rng.uniform(0.05, 0.4, DIVISIONS), PIECE_SIZE)
+    return rng.standard_normal(DIVISIONS * PIECE_SIZE) * levels
+
+
+@pytest.mark.parametrize("match_rms", [0.05, 0.3, 0.6, 0.9])
+def test_gain_reaches_the_match_rms(result_mid, match_rms):
+    gain = SortedLevels(result_mid, DIVISIONS, PIECE_SIZE).gain(match_rms, 1e-6)
+
+    pieces = result_mid.reshape(DIVISIONS, PIECE_SIZE)
+    rmses = np.sqrt(np.mean(pieces ** 2, axis=1))
+    loudest = pieces[rmses >= np.sqrt(np.mean(rmses ** 2))]
+    clipped = np.minimum(gain * np.abs(loudest), 1)
+    assert np.sqrt(np.mean(clipped ** 2)) == pytest.approx(match_rms, rel=1e-9)
+
+    histograms = LevelHistograms(DIVISIONS, PIECE_SIZE)
+    histograms.add(result_mid)
+    assert histograms.gain(match_rms, 1e-6) == pytest.approx(gain, rel=1e-3)
@@ -0,0 +1,27 @@
+from matchering.memory import measure_memory, check_budgets
+
+SECONDS = 30
+# DEFAULT_BUDGETS hold from 3 min on. On a 30 s track the reference, the FIRs and the FFT
+# batches weigh more against the target: the peaks measured without the limiter plus a quarter
+# (process: 7.9 copies, match_frequencies: 2.9, get_reference_analysis: 3.1)
+SHORT_TRACK_BUDGETS = {
+    "process": 10.0,
+    "check": 1.5,
+    "match_levels": 3.0,
+    "analyze_levels": 1.75,
+    "get_reference_analysis": 4.0,
+    "get_fir": 1.5,
+    "match_frequencies": 3.75,
+    "convolve": 2.5,
+    "correct_levels": 1.25,
+    "finalize": 1.25,
+    "save": 0.25,
+}
+
+
+def test_short_track_budgets(tmp_path):
+    report = measure_memory(SECONDS, str(tmp_path), use_limiter=False)
+
+    assert "limiter" not in report["stages"]
+    assert set(SHORT_TRACK_BUDGETS) <= set(report["stages"])
+    assert check_budgets(report, SHORT_TRACK_BUDGETS) == []
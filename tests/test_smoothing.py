@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from matchering import Config
+from matchering.benchmark import synthesize
+from matchering.dsp import lr_to_ms
+from matchering.log import Code
+from matchering.presets import get_preset
+from matchering.smoothing import compare_smoothing, smoothing_warnings
+from matchering.stage_helpers.match_frequencies import average_fft, get_fir_plan
+
+# The bounds of the README: {backend: (max deviation from LOWESS in dB, RMS deviation in dB)}
+BOUNDS = {
+    "local_regression": (0.05, 0.005),
+    "fractional_octave": (8.0, 0.5),
+    "savgol": (8.0, 1.0),
+}
+# The widths of the fast backends were fitted on the synthetic track of the default seed
+# and a 70 s track, these targets were not used for the fitting
+TARGETS = {
+    "dark": {"seed": 1, "brightness": 0.5},
+    "bright": {"seed": 2, "brightness": 2.0, "drive": 1.5},
+    "saturated": {"seed": 3, "drive": 3.0},
+}
+
+
+@pytest.fixture(scope="module")
+def targets(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("smoothing")
+    decoded = {}
+    for name, options in TARGETS.items():
+        file = synthesize(str(folder / f"{name}.wav"), 30, **options)
+        audio, _ = sf.read(file, always_2d=True)
+        decoded[name] = lr_to_ms(np.ascontiguousarray(audio.T))
+    return decoded
+
+
+@pytest.mark.parametrize("target_name", list(TARGETS))
+@pytest.mark.parametrize("fft_size", [4096, 8192])
+@pytest.mark.parametrize("kind", ["mid", "side"])
+def test_compare_smoothing(targets, target_name, fft_size, kind):
+    # The matching curve of a synthetic target against the pop preset,
+    # on the logarithmic grid that the backends smooth
+    config = Config(fft_size=fft_size)
+    plan = get_fir_plan(config.internal_sample_rate, fft_size, config.lin_log_oversampling)
+    target = targets[target_name]
+    channel = target[0] if kind == "mid" else target[1]
+    pieces = channel[: len(channel) // fft_size * fft_size].reshape(-1, fft_size)
+    target_fft = average_fft(pieces, config.internal_sample_rate, fft_size)
+    reference_fft = get_preset("pop").spectrum(kind, fft_size)
+    curve = plan.to_logarithmic(reference_fft / np.maximum(target_fft, config.min_value))
+
+    comparison = compare_smoothing(curve, config)
+
+    assert comparison["lowess"][:2] == (0.0, 0.0)
+    for backend, (max_deviation, rms_deviation) in BOUNDS.items():
+        measured_max, measured_rms, _ = comparison[backend]
+        assert measured_max < max_deviation, f"{backend}: max {measured_max:.2f} dB"
+        assert measured_rms < rms_deviation, f"{backend}: RMS {measured_rms:.3f} dB"
+
+
+@pytest.mark.parametrize(
+    "options, codes",
+    [
+        ({"smoothing": "lowess", "lowess_it": 2}, []),
+        ({"smoothing": "local_regression"}, []),
+        (
+            {"smoothing": "local_regression", "lowess_it": 2},
+            [Code.WARNING_LOWESS_OPTIONS_ARE_IGNORED],
+        ),
+        (
+            {"smoothing": "local_regression", "lowess_delta": 0.01},
+            [Code.WARNING_LOWESS_OPTIONS_ARE_IGNORED],
+        ),
+        ({"smoothing": "savgol"}, [Code.WARNING_SMOOTHING_IS_EXPERIMENTAL]),
+    ],
+)
+def test_smoothing_warnings(options, codes):
+    assert smoothing_warnings(Config(**options)) == codes